@@ -0,0 +1,167 @@
+import argparse
+import json
+import multiprocessing as mp
+import os
+import sys
+import tempfile
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import combine_and_clean_data as cleaning
+from line import normalize_condition_labels, prepare_fully_scaled_data, scale_traits
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_memory.json')
+TRAITS = [
+    'root system length', 'root system volume', 'root system diameter',
+    'root system diameter max', 'root system diameter min', 'root system area',
+    'root system surface area', 'root system width', 'root system depth',
+    'root system convex area', 'root system solidity', 'root system angle',
+]
+
+def make_reference_dataset(folder, n_genotypes=300, n_reps=3, rows_per_file=40, seed=0):
+    """
+    Writes the synthetic reference raw data: a wide metadata sheet with
+    WW/WL replicate columns and one Parquet raw file per plot.
+
+    Parameters:
+    - folder (str): Output folder (gets meta.xlsx and raw/).
+    - n_genotypes (int): Number of genotypes.
+    - n_reps (int): Replicate plots per genotype and condition.
+    - rows_per_file (int): Trait rows in every raw file.
+    - seed (int): Random seed.
+
+    Returns:
+    - tuple: (raw file pattern, metadata path).
+    """
+    rng = np.random.default_rng(seed)
+    raw_dir = os.path.join(folder, 'raw')
+    os.makedirs(raw_dir, exist_ok=True)
+
+    rows = []
+    plot = 1000
+    for g in range(n_genotypes):
+        for cond in ('WW', 'WL'):
+            row = {'genotype': f'SC{g:04d}', 'treatment': cond}
+            for r in range(n_reps):
+                row[f'rep{r + 1}'] = plot
+                plot += 1
+            rows.append(row)
+    metadata_path = os.path.join(folder, 'meta.xlsx')
+    pd.DataFrame(rows).to_excel(metadata_path, index=False)
+
+    for plot_number in range(1000, plot):
+        values = rng.lognormal(mean=2.0, sigma=0.5, size=(rows_per_file, len(TRAITS)))
+        pd.DataFrame(values, columns=TRAITS).to_parquet(os.path.join(raw_dir, f'T_{plot_number}.parquet'))
+    return os.path.join(raw_dir, '*'), metadata_path
+
+def make_trait_frame(n_rows=200000, n_genotypes=500, seed=0):
+    """
+    Builds the synthetic reference wide table (Genotype, Condition, traits)
+    used for the in-memory stages; large enough that data, not overhead, dominates.
+    """
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame(rng.lognormal(mean=2.0, sigma=0.5, size=(n_rows, len(TRAITS))), columns=TRAITS)
+    df.iloc[::9, 1] = np.nan
+    df.insert(0, 'Genotype', [f'SC{g:04d}' for g in rng.integers(n_genotypes, size=n_rows)])
+    df.insert(1, 'Condition', rng.choice(['WELL_WATERED', 'WATER_LIMITED'], size=n_rows))
+    return df
+
+def _measure_child(func, args):
+    # runs in a forked child: the Arrow pool swap and anything allocated from
+    # it never outlive the process, which exits without interpreter teardown
+    arrow_pool = pa.proxy_memory_pool(pa.default_memory_pool())
+    pa.set_memory_pool(arrow_pool)
+    tracemalloc.start()
+    result = func(*args)
+    _, python_peak = tracemalloc.get_traced_memory()
+    del result
+    return python_peak + arrow_pool.max_memory()
+
+def measure(func, *args):
+    """
+    Runs func(*args) in a fresh forked process and returns the peak memory it
+    allocated in bytes: Python/NumPy allocations (tracemalloc) plus Arrow
+    buffers (a proxy memory pool).
+    """
+    with ProcessPoolExecutor(max_workers=1, mp_context=mp.get_context('fork')) as pool:
+        return pool.submit(_measure_child, func, args).result()
+
+def run_benchmark(folder):
+    """
+    Measures peak memory of each stage of the cleaning and plotting data path.
+
+    Returns:
+    - dict: Stage name -> peak bytes.
+    """
+    pattern, metadata_path = make_reference_dataset(folder)
+    wide = pd.read_excel(metadata_path)
+    df = make_trait_frame()
+    normalized = normalize_condition_labels(df.copy())
+    plots = cleaning.scale_factor(cleaning.combine_plots(pattern, metadata_path))
+    cleaning._RAW_CACHE.clear()
+
+    return {
+        'process_metadata': measure(cleaning.process_metadata, wide),
+        'combine_plots': measure(cleaning.combine_plots, pattern, metadata_path),
+        'average_by_genotype': measure(cleaning.average_by_genotype, plots),
+        'replace_outliers_iqr': measure(cleaning.replace_outliers_iqr, df),
+        'normalize_condition_labels': measure(normalize_condition_labels, df),
+        'scale_traits': measure(scale_traits, normalized),
+        'prepare_fully_scaled_data': measure(prepare_fully_scaled_data, normalized),
+    }
+
+def compare(peaks, baseline, tolerance):
+    """
+    Prints every stage against the baseline.
+
+    Returns:
+    - list: Stages whose peak exceeds the baseline by more than tolerance.
+    """
+    regressions = []
+    print(f"{'Stage':<28} {'Peak MiB':>10} {'Baseline':>10} {'Change':>8}")
+    for stage, peak in peaks.items():
+        base = baseline.get(stage)
+        if base is None:
+            print(f"{stage:<28} {peak / 2 ** 20:>10.2f} {'-':>10} {'new':>8}")
+            continue
+        change = peak / base - 1
+        flag = ''
+        if change > tolerance:
+            regressions.append(stage)
+            flag = '  REGRESSION'
+        print(f"{stage:<28} {peak / 2 ** 20:>10.2f} {base / 2 ** 20:>10.2f} {change:>+8.1%}{flag}")
+    return regressions
+
+def main():
+    """
+    CLI for the peak-memory regression check on the synthetic reference dataset.
+    """
+    p = argparse.ArgumentParser(description="Peak-memory benchmark of the data path; exits 1 on regression.")
+    p.add_argument('--baseline', default=BASELINE, help='Baseline JSON with peak bytes per stage')
+    p.add_argument('--tolerance', type=float, default=0.10, help='Allowed relative increase over the baseline')
+    p.add_argument('--update', action='store_true', help='Write the measured peaks as the new baseline')
+    args = p.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        peaks = run_benchmark(folder)
+
+    if args.update:
+        with open(args.baseline, 'w') as fh:
+            json.dump(peaks, fh, indent=2)
+        print(f"Saved memory baseline to {args.baseline}")
+        return 0
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as fh:
+            baseline = json.load(fh)
+    regressions = compare(peaks, baseline, args.tolerance)
+    if regressions:
+        print(f"Peak memory regressed for: {', '.join(regressions)}")
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
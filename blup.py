@@ -0,0 +1,239 @@
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from scipy.sparse.linalg import splu
+from excel_export import read_excel_sheets, write_excel
+from line import normalize_condition_labels
+from trait_store import read_plot_store
+
+NON_TRAITS = ['Experiment', 'Region', 'Environment', 'Condition', 'Genotype', 'plot_number', 'Unnamed: 0']
+
+def _one_hot(codes, n_levels):
+    n = len(codes)
+    return sp.csr_matrix((np.ones(n), (np.arange(n), codes)), shape=(n, n_levels))
+
+def build_design(df_plots):
+    """
+    Builds sparse design matrices for plot-level data.
+
+    Fixed effects are one column per Environment x Condition cell, which covers
+    the Environment and Condition main effects and their interaction.
+    Random effects are Genotype and, when there are several cells and genotypes
+    are replicated within them, Genotype x Environment x Condition (G x E) for
+    the genotypes observed in more than one cell.
+
+    Parameters:
+    - df_plots (pd.DataFrame): Rows with 'Genotype', 'Condition' and optionally 'Experiment'/'Region'.
+
+    Returns:
+    - dict: 'X' (fixed), 'Z' (list of random blocks), 'terms', 'genotypes'.
+    """
+    env_col = next((c for c in ('Experiment', 'Region') if c in df_plots.columns), None)
+    env = df_plots[env_col].astype(str) if env_col else pd.Series('all', index=df_plots.index)
+    cell = env + '|' + df_plots['Condition'].astype(str)
+    genotype = df_plots['Genotype'].astype(str)
+
+    cell_codes, cells = pd.factorize(cell, sort=True)
+    g_codes, genotypes = pd.factorize(genotype, sort=True)
+    X = _one_hot(cell_codes, len(cells))
+    Z = [_one_hot(g_codes, len(genotypes))]
+    terms = ['Genotype']
+
+    # G x E is only identifiable for genotypes seen in more than one cell;
+    # otherwise each G x E level would just repeat its Genotype level
+    cells_per_genotype = pd.Series(cell_codes).groupby(g_codes).nunique().to_numpy()
+    multi = cells_per_genotype[g_codes] > 1
+    ge = (genotype + '|' + cell)[multi]
+    if len(cells) > 1 and ge.duplicated().any():
+        ge_codes, ge_levels = pd.factorize(ge, sort=True)
+        rows = np.flatnonzero(multi)
+        Z.append(sp.csr_matrix((np.ones(len(rows)), (rows, ge_codes)), shape=(len(df_plots), len(ge_levels))))
+        terms.append('GxE')
+
+    return {'X': X, 'Z': Z, 'terms': terms, 'genotypes': list(genotypes)}
+
+def _block_traces(lu, offsets, sizes, probes):
+    """
+    Traces of the diagonal blocks of the inverse MME coefficient matrix.
+    Blocks with probe vectors use Hutchinson's estimator; the others are solved exactly.
+    """
+    dim = lu.shape[0]
+    traces = []
+    for start, size, z in zip(offsets, sizes, probes):
+        if z is None:
+            traces.append(_block_diagonal(lu, start, size).sum())
+            continue
+        rhs = np.zeros((dim, z.shape[1]))
+        rhs[start:start + size] = z
+        solved = lu.solve(rhs)[start:start + size]
+        traces.append(np.mean(np.sum(z * solved, axis=0)))
+    return traces
+
+def _block_diagonal(lu, start, size, chunk=256):
+    """
+    Exact diagonal of one block of the inverse, solved a chunk of unit vectors at a time.
+    """
+    dim = lu.shape[0]
+    diag = np.empty(size)
+    for a in range(0, size, chunk):
+        b = min(a + chunk, size)
+        rhs = np.zeros((dim, b - a))
+        rhs[start + np.arange(a, b), np.arange(b - a)] = 1.0
+        solved = lu.solve(rhs)
+        diag[a:b] = solved[start + np.arange(a, b), np.arange(b - a)]
+    return diag
+
+def fit_trait(y, X, Z, max_iter=200, tol=1e-4, n_probes=50, exact_limit=200, seed=0):
+    """
+    Fits one trait with EM-REML on Henderson's mixed model equations, solved
+    with a sparse LU factorisation. The trace terms of the EM updates are
+    estimated with fixed Rademacher probes for blocks larger than exact_limit;
+    reliabilities always use the exact prediction error variances.
+
+    Parameters:
+    - y (np.ndarray): Plot-level trait values (NaN rows are dropped).
+    - X (scipy.sparse matrix): Fixed-effect design.
+    - Z (list): Random-effect designs; the first one must be Genotype.
+    - max_iter (int): Maximum EM iterations.
+    - tol (float): Relative change in variance components to stop at.
+    - n_probes (int): Probe vectors for trace estimation on large blocks.
+    - exact_limit (int): Blocks up to this size get exact traces.
+    - seed (int): Random seed for the probes.
+
+    Returns:
+    - dict: 'blup' and 'reliability' for the Genotype levels, 'variances' (one per random term, then residual).
+    """
+    ok = ~np.isnan(y)
+    y = y[ok]
+    X = X[ok]
+    X = X[:, np.asarray(X.sum(axis=0)).ravel() > 0]
+    Zs = [z[ok] for z in Z]
+    W = sp.hstack([X] + Zs, format='csc')
+    n, p = X.shape
+    sizes = [z.shape[1] for z in Zs]
+    offsets = list(p + np.cumsum([0] + sizes[:-1]))
+
+    WtW = (W.T @ W).tocsc()
+    Wty = W.T @ y
+    rng = np.random.default_rng(seed)
+    probes = [rng.choice([-1.0, 1.0], size=(size, n_probes)) if size > exact_limit else None
+              for size in sizes]
+
+    var_y = np.var(y) if n > 1 else 1.0
+    var_y = var_y if var_y > 0 else 1.0
+    var_e = var_y / 2
+    var_u = [var_y / (2 * len(Zs))] * len(Zs)
+
+    for _ in range(max_iter):
+        ratios = np.concatenate([np.zeros(p)] + [np.full(s, var_e / v) for s, v in zip(sizes, var_u)])
+        lu = splu(WtW + sp.diags(ratios, format='csc'))
+        sol = lu.solve(Wty)
+        traces = _block_traces(lu, offsets, sizes, probes)
+
+        new_e = (y @ y - sol @ Wty) / (n - p) if n > p else var_e
+        new_u = []
+        for start, size, trace in zip(offsets, sizes, traces):
+            u = sol[start:start + size]
+            new_u.append(max((u @ u + var_e * trace) / size, 1e-10 * var_y))
+        new_e = max(new_e, 1e-10 * var_y)
+
+        change = max(abs(a - b) / max(b, 1e-12) for a, b in zip(new_u + [new_e], var_u + [var_e]))
+        var_u, var_e = new_u, new_e
+        if change < tol:
+            break
+
+    ratios = np.concatenate([np.zeros(p)] + [np.full(s, var_e / v) for s, v in zip(sizes, var_u)])
+    lu = splu(WtW + sp.diags(ratios, format='csc'))
+    sol = lu.solve(Wty)
+    g_start, g_size = offsets[0], sizes[0]
+    pev = var_e * _block_diagonal(lu, g_start, g_size)
+    return {
+        'blup': sol[g_start:g_start + g_size],
+        'reliability': np.clip(1 - pev / var_u[0], 0.0, 1.0),
+        'variances': var_u + [var_e],
+    }
+
+# design shared with worker processes, set once per process by _init_worker
+_DESIGN = {}
+
+def _init_worker(design, options):
+    _DESIGN['design'] = design
+    _DESIGN['options'] = options
+
+def _fit_one(args):
+    trait, y = args
+    design = _DESIGN['design']
+    return trait, fit_trait(y, design['X'], design['Z'], **_DESIGN['options'])
+
+def fit_blups(df_plots, traits=None, workers=None, **options):
+    """
+    Fits the mixed model for every trait in parallel and collects BLUPs.
+
+    Parameters:
+    - df_plots (pd.DataFrame): Plot-level rows with 'Genotype', 'Condition', trait columns
+      and optionally 'Experiment'/'Region' as the environment.
+    - traits (list): Traits to fit. If None, all numeric traits are used.
+    - workers (int): Number of worker processes (defaults to the CPU count).
+    - options: Passed on to fit_trait (max_iter, tol, n_probes, exact_limit, seed).
+
+    Returns:
+    - tuple: (BLUP table with Trait, Genotype, BLUP, Reliability, Rank;
+              variance-component table with one row per trait).
+    """
+    if traits is None:
+        traits = [c for c in df_plots.select_dtypes(include='number').columns if c not in NON_TRAITS]
+    df = df_plots.dropna(subset=['Genotype', 'Condition'])
+    design = build_design(df)
+
+    jobs = [(t, df[t].to_numpy(dtype=np.float64)) for t in traits]
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(design, options)) as pool:
+        fits = list(pool.map(_fit_one, jobs))
+
+    blup_frames, components = [], []
+    for trait, fit in fits:
+        table = pd.DataFrame({
+            'Trait': trait,
+            'Genotype': design['genotypes'],
+            'BLUP': fit['blup'],
+            'Reliability': fit['reliability'],
+        })
+        table['Rank'] = table['BLUP'].rank(ascending=False, method='min').astype(int)
+        blup_frames.append(table.sort_values('Rank'))
+
+        row = {'Trait': trait}
+        for term, var in zip(design['terms'] + ['Residual'], fit['variances']):
+            row[f'V {term}'] = var
+        components.append(row)
+
+    return pd.concat(blup_frames, ignore_index=True), pd.DataFrame(components)
+
+def main():
+    """
+    CLI for multi-environment BLUPs of genotype effects per trait.
+    """
+    p = argparse.ArgumentParser(description="Mixed-model BLUPs and reliabilities for genotype ranking.")
+    p.add_argument('--store', help='Plot-level store folder (from combine_and_clean_data.py --plot-store)')
+    p.add_argument('--input', help='Plot-level Excel file (alternative to --store)')
+    p.add_argument('--output', default="/srv/data/blups.xlsx", help='Path to save BLUPs and variance components (Excel)')
+    p.add_argument('--traits', nargs='+', help='Traits to fit (default: all numeric traits)')
+    p.add_argument('--workers', type=int, help='Number of worker processes (default: CPU count)')
+    p.add_argument('--max-iter', type=int, default=200, help='Maximum EM-REML iterations per trait')
+    args = p.parse_args()
+
+    if args.store:
+        df = read_plot_store(args.store, traits=args.traits)
+    elif args.input:
+        df = read_excel_sheets(args.input)
+    else:
+        p.error("either --store or --input is required")
+    df = normalize_condition_labels(df)
+
+    blups, components = fit_blups(df, traits=args.traits, workers=args.workers, max_iter=args.max_iter)
+    write_excel({'BLUPs': blups, 'Variance components': components}, args.output)
+    print(f"Saved BLUPs for {blups['Trait'].nunique()} traits to {args.output}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,274 @@
+import argparse
+import os
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+import plotly.express as px
+import plotly.figure_factory as ff
+from scipy.cluster.hierarchy import fcluster, linkage
+from excel_export import read_excel_sheets, write_excel
+from line import normalize_condition_labels, scale_traits
+
+def trait_profiles(df_scaled, condition):
+    """
+    Extracts the genotype x trait matrix of scaled values for one condition.
+
+    Parameters:
+    - df_scaled (pd.DataFrame): Wide DataFrame from line.scale_traits.
+    - condition (str): Condition to keep (e.g. 'HI' or 'LI').
+
+    Returns:
+    - pd.DataFrame: One row per genotype, one column per trait.
+    """
+    df = df_scaled[df_scaled['Condition'] == condition]
+    trait_cols = df.select_dtypes(include='number').columns
+    return df.groupby('Genotype')[trait_cols].mean()
+
+def _row_blocks(n_rows, block_rows):
+    return [(start, min(start + block_rows, n_rows)) for start in range(0, n_rows, block_rows)]
+
+def _correlation_sums(block):
+    mask = ~np.isnan(block)
+    x = np.where(mask, block, 0.0)
+    m = mask.astype(np.float64)
+    return (m.T @ m, x.T @ m, (x * x).T @ m, x.T @ x)
+
+def blocked_correlation(X, block_rows=4096, workers=None):
+    """
+    Pairwise-complete Pearson correlation between the columns of X.
+    Rows are processed in blocks and only p x p sums are kept, so memory
+    stays bounded by the block size no matter how many rows X has.
+    Blocks are reduced on a thread pool (the matrix products release the GIL).
+
+    Parameters:
+    - X (np.ndarray): n x p matrix, NaN for missing values.
+    - block_rows (int): Rows per block.
+    - workers (int): Number of threads (defaults to the CPU count).
+
+    Returns:
+    - np.ndarray: p x p correlation matrix (NaN where fewer than 2 shared values).
+    """
+    X = np.asarray(X, dtype=np.float64)
+    p = X.shape[1]
+    n = np.zeros((p, p))
+    sx = np.zeros((p, p))
+    sxx = np.zeros((p, p))
+    sxy = np.zeros((p, p))
+
+    blocks = (X[start:stop] for start, stop in _row_blocks(X.shape[0], block_rows))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for bn, bsx, bsxx, bsxy in pool.map(_correlation_sums, blocks):
+            n += bn
+            sx += bsx
+            sxx += bsxx
+            sxy += bsxy
+
+    # sx[i, j] sums column i over rows where both i and j are present
+    sy = sx.T
+    syy = sxx.T
+    with np.errstate(invalid='ignore', divide='ignore'):
+        cov = n * sxy - sx * sy
+        var = (n * sxx - sx * sx) * (n * syy - sy * sy)
+        corr = cov / np.sqrt(var)
+    corr[n < 2] = np.nan
+    return np.clip(corr, -1.0, 1.0)
+
+def correlation_by_condition(df_scaled, block_rows=4096, workers=None):
+    """
+    Computes a trait x trait correlation matrix for every condition.
+
+    Parameters:
+    - df_scaled (pd.DataFrame): Wide DataFrame from line.scale_traits.
+    - block_rows (int): Rows per block.
+    - workers (int): Number of threads.
+
+    Returns:
+    - dict: Condition -> trait x trait correlation DataFrame.
+    """
+    result = {}
+    for cond in sorted(df_scaled['Condition'].unique()):
+        profiles = trait_profiles(df_scaled, cond)
+        corr = blocked_correlation(profiles.to_numpy(), block_rows=block_rows, workers=workers)
+        result[cond] = pd.DataFrame(corr, index=profiles.columns, columns=profiles.columns)
+    return result
+
+def _impute_column_means(X):
+    X = np.array(X, dtype=np.float64)
+    col_means = np.nanmean(X, axis=0)
+    col_means = np.where(np.isnan(col_means), 0.0, col_means)
+    rows, cols = np.nonzero(np.isnan(X))
+    X[rows, cols] = col_means[cols]
+    return X
+
+def _nearest_centroid(args):
+    block, centroids = args
+    # squared distances without the constant |x|^2 term
+    dist = (centroids * centroids).sum(axis=1) - 2.0 * block @ centroids.T
+    return dist.argmin(axis=1)
+
+def kmeans(X, k, n_iter=100, seed=0, block_rows=4096, workers=None):
+    """
+    Lloyd's k-means with k-means++ seeding. Distances are computed per row
+    block on a thread pool, so memory stays at block_rows x k.
+
+    Parameters:
+    - X (np.ndarray): n x p matrix (missing values are replaced by column means).
+    - k (int): Number of clusters.
+    - n_iter (int): Maximum number of iterations.
+    - seed (int): Random seed for the initial centroids.
+    - block_rows (int): Rows per block.
+    - workers (int): Number of threads.
+
+    Returns:
+    - np.ndarray: Cluster label (0..k-1) for every row.
+    """
+    X = _impute_column_means(X)
+    n = X.shape[0]
+    if not 1 <= k <= n:
+        raise ValueError(f"k must be between 1 and the number of genotypes ({n})")
+    rng = np.random.default_rng(seed)
+
+    centroids = [X[rng.integers(n)]]
+    closest = ((X - centroids[0]) ** 2).sum(axis=1)
+    for _ in range(1, k):
+        total = closest.sum()
+        idx = rng.choice(n, p=closest / total) if total > 0 else rng.integers(n)
+        centroids.append(X[idx])
+        closest = np.minimum(closest, ((X - X[idx]) ** 2).sum(axis=1))
+    centroids = np.array(centroids)
+
+    blocks = _row_blocks(n, block_rows)
+    labels = np.full(n, -1)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for _ in range(n_iter):
+            parts = pool.map(_nearest_centroid, ((X[a:b], centroids) for a, b in blocks))
+            new_labels = np.concatenate(list(parts))
+            if np.array_equal(new_labels, labels):
+                break
+            labels = new_labels
+            counts = np.bincount(labels, minlength=k)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, X)
+            filled = counts > 0
+            centroids[filled] = sums[filled] / counts[filled, None]
+    return labels
+
+def hierarchical(X, k, method='ward'):
+    """
+    Agglomerative clustering of the rows of X. Unlike the blocked functions
+    above, this needs the full condensed distance matrix: O(n^2) memory in
+    the number of genotypes. Use kmeans for very large panels.
+
+    Parameters:
+    - X (np.ndarray): n x p matrix (missing values are replaced by column means).
+    - k (int): Number of clusters to cut the tree into.
+    - method (str): scipy linkage method.
+
+    Returns:
+    - tuple: (labels 0..k-1 for every row, linkage matrix).
+    """
+    X = _impute_column_means(X)
+    Z = linkage(X, method=method)
+    labels = fcluster(Z, t=k, criterion='maxclust') - 1
+    return labels, Z
+
+def plot_correlation_heatmap(corr, condition, title_prefix="", out_html=None):
+    """
+    Plots a trait x trait correlation heatmap.
+
+    Parameters:
+    - corr (pd.DataFrame): Correlation matrix.
+    - condition (str): Condition label for the title.
+    - title_prefix (str): Region or context to prepend to the plot title.
+    - out_html (str): Saves the plot to a HTML file.
+    """
+    fig = px.imshow(
+        corr,
+        zmin=-1, zmax=1,
+        color_continuous_scale='RdBu_r',
+        title=f'{title_prefix} — {condition} Trait Correlation'
+    )
+    fig.update_layout(xaxis_tickangle=-45, template='plotly_white')
+    if out_html:
+        fig.write_html(out_html)
+        print(f"Saved plot to {out_html}")
+    else:
+        fig.show()
+
+def plot_dendrogram(profiles, condition, method='ward', title_prefix="", out_html=None, Z=None):
+    """
+    Plots a dendrogram of genotypes clustered on their scaled trait profiles.
+
+    Parameters:
+    - profiles (pd.DataFrame): Genotype x trait matrix.
+    - condition (str): Condition label for the title.
+    - method (str): scipy linkage method.
+    - title_prefix (str): Region or context to prepend to the plot title.
+    - out_html (str): Saves the plot to a HTML file.
+    - Z (np.ndarray): Linkage matrix from hierarchical(); computed here if None.
+    """
+    X = _impute_column_means(profiles.to_numpy())
+    if Z is None:
+        Z = linkage(X, method=method)
+    # reuse the linkage and skip create_dendrogram's own pdist, so the
+    # O(n^2) distance matrix is built only once
+    fig = ff.create_dendrogram(
+        X,
+        labels=profiles.index.tolist(),
+        distfun=lambda x: None,
+        linkagefun=lambda _: Z
+    )
+    fig.update_layout(
+        title=f'{title_prefix} — {condition} Genotype Clustering',
+        xaxis_tickangle=-45,
+        template='plotly_white'
+    )
+    if out_html:
+        fig.write_html(out_html)
+        print(f"Saved plot to {out_html}")
+    else:
+        fig.show()
+
+def main():
+    """
+    CLI for trait correlation heatmaps and genotype clustering per condition.
+    """
+    p = argparse.ArgumentParser(description="Trait correlations and genotype clusters on scaled trait profiles.")
+    p.add_argument('--input', default="/srv/data/cleaned.xlsx", help='Cleaned Excel input file')
+    p.add_argument('--output', default="/srv/data/clustering.html", help='Base path for the HTML plots')
+    p.add_argument('--clusters-output', default="/srv/data/clusters.xlsx", help='Path to save genotype cluster labels (Excel)')
+    p.add_argument('--scale', choices=['zscore', 'minmax'], default='zscore', help='Scaling method for traits')
+    p.add_argument('--method', choices=['hierarchical', 'kmeans'], default='hierarchical', help='Genotype clustering method')
+    p.add_argument('--k', type=int, default=4, help='Number of genotype clusters')
+    p.add_argument('--workers', type=int, help='Number of threads (default: CPU count)')
+    p.add_argument('--block-rows', type=int, default=4096, help='Rows per block for the blocked computations')
+    p.add_argument('--region', default="", help='Region label in plot titles')
+    args = p.parse_args()
+
+    df = read_excel_sheets(args.input)
+    df = normalize_condition_labels(df)
+    df_scaled = scale_traits(df, scale=args.scale)
+
+    base, ext = os.path.splitext(args.output)
+    correlations = correlation_by_condition(df_scaled, block_rows=args.block_rows, workers=args.workers)
+
+    assignments = []
+    for cond, corr in correlations.items():
+        plot_correlation_heatmap(corr, cond, title_prefix=args.region,
+                                 out_html=f"{base}_corr_{cond}{ext}")
+
+        profiles = trait_profiles(df_scaled, cond)
+        k = min(args.k, len(profiles))
+        if args.method == 'kmeans':
+            labels = kmeans(profiles.to_numpy(), k, block_rows=args.block_rows, workers=args.workers)
+        else:
+            labels, Z = hierarchical(profiles.to_numpy(), k)
+            plot_dendrogram(profiles, cond, title_prefix=args.region,
+                            out_html=f"{base}_dendrogram_{cond}{ext}", Z=Z)
+        assignments.append(pd.DataFrame({'Genotype': profiles.index, 'Condition': cond, 'Cluster': labels}))
+
+    write_excel(pd.concat(assignments, ignore_index=True), args.clusters_output)
+    print(f"Saved genotype clusters to {args.clusters_output}")
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,32 @@
 import argparse
+import functools
 import pandas as pd
 import glob
 import numpy as np
 import os
 import re
+from concurrent.futures import ProcessPoolExecutor
+from excel_export import write_excel, write_workbooks
+from trait_store import write_plot_store
+
+# parsed raw files, keyed by (path, mtime, size, traits) so a batch run reads each file once
+_RAW_CACHE = {}
+
+RAW_EXTENSIONS = {
+    '.xlsx': 'excel',
+    '.xlsm': 'excel',
+    '.xls': 'excel',
+    '.csv': 'csv',
+    '.tsv': 'tsv',
+    '.parquet': 'parquet',
+    '.pq': 'parquet',
+}
+
+MAGIC_BYTES = {
+    b'PK\x03\x04': 'excel',          # xlsx/xlsm (zip container)
+    b'\xd0\xcf\x11\xe0': 'excel',      # legacy xls (OLE2)
+    b'PAR1': 'parquet',
+}
 
 def process_metadata(metadata_df):
     """
@@ -16,7 +39,8 @@ def process_metadata(metadata_df):
     Returns a DataFrame with ['plot_number', 'Genotype', 'Condition'].
     """
     metadata_df.columns = metadata_df.columns.str.strip().str.lower()
-    df = metadata_df.copy()
+    # melt builds new frames, so the input is never modified beyond its header
+    df = metadata_df
 
     genotype_col   = next((c for c in df.columns if 'genotype' in c), None)
     rep_columns    = [c for c in df.columns if 'rep' in c]
@@ -67,34 +91,183 @@ def process_metadata(metadata_df):
 
     return melted[['plot_number', 'Genotype', 'Condition']]
 
-def combine_excels(file_pattern, metadata_path):
+def load_metadata(metadata_path):
     """
-    Combines multiple Excel files into a single cleaned DataFrame.
-    Averages numeric trait columns by plot, merges with metadata,
-    and computes average trait values grouped by Genotype and Condition.
+    Reads the metadata Excel file into long format with cleaned genotype names.
 
     Parameters:
-    - file_pattern (str): Glob pattern to find all relevant Excel files.
     - metadata_path (str): Path to the Excel metadata file.
 
     Returns:
-    - pd.DataFrame: Merged and averaged DataFrame ready for scaling/cleaning.
+    - pd.DataFrame: DataFrame with ['plot_number', 'Genotype', 'Condition'].
+    """
+    metadata_df  = pd.read_excel(metadata_path)
+    metadata_long = process_metadata(metadata_df)
+    metadata_long['Genotype'] = metadata_long['Genotype'].str.replace('.', '', regex=False)
+    return metadata_long
+
+def detect_format(filename):
+    """
+    Detects the format of a raw trait file from its extension, falling back
+    to the file's magic bytes for unknown extensions.
+
+    Parameters:
+    - filename (str): Path to the raw file.
+
+    Returns:
+    - str | None: 'excel', 'csv', 'tsv' or 'parquet', or None if the file is not a trait file.
+    """
+    ext = os.path.splitext(filename)[1].lower()
+    if ext in RAW_EXTENSIONS:
+        return RAW_EXTENSIONS[ext]
+    with open(filename, 'rb') as fh:
+        head = fh.read(4)
+    return MAGIC_BYTES.get(head)
+
+def list_raw_files(file_pattern):
+    """
+    Lists the files matching a glob pattern that are readable trait files.
+
+    Parameters:
+    - file_pattern (str): Glob pattern, e.g. 'data/raw/*'.
+
+    Returns:
+    - list: Sorted paths of supported files (hidden files such as .DS_Store are skipped).
     """
-    file_list = glob.glob(file_pattern)
-    data_frames = []
+    return [f for f in sorted(glob.glob(file_pattern))
+            if os.path.isfile(f) and detect_format(f) is not None]
+
+def plot_number_from_filename(filename):
+    """
+    Extracts the plot number from a raw file name, e.g. 'T_1104_1_trait.xlsx' -> '1104'.
+    """
+    base = os.path.basename(filename).rsplit('.', 1)[0]
+
+    # find all digit-runs, pick the longest (e.g. "1104" over "1")
+    nums = re.findall(r'\d+', base)
+    if not nums:
+        raise ValueError(f"Could not extract any digits from filename: {base}")
+    return max(nums, key=len)
+
+def select_preview_files(file_list, metadata_long, fraction, seed=0):
+    """
+    Picks a random subset of raw files, stratified by Genotype x Condition
+    through the metadata, so every stratum keeps at least one file.
+
+    Parameters:
+    - file_list (list): Paths of raw trait files.
+    - metadata_long (pd.DataFrame): Metadata from load_metadata.
+    - fraction (float): Share of files to keep in each stratum, in (0, 1].
+    - seed (int): Random seed, so the same preview is drawn every time.
+
+    Returns:
+    - list: Sorted paths of the selected files.
+    """
+    if not 0 < fraction <= 1:
+        raise ValueError("Preview fraction must be in (0, 1].")
+
+    strata = metadata_long.drop_duplicates('plot_number').set_index('plot_number')
+    strata = strata['Genotype'].astype(str) + '|' + strata['Condition'].astype(str)
+    files = pd.DataFrame({'file': file_list})
+    files['stratum'] = [strata.get(plot_number_from_filename(f), 'unmapped') for f in file_list]
+
+    rng = np.random.default_rng(seed)
+    selected = []
+    for _, group in files.groupby('stratum', sort=True):
+        n_keep = int(np.ceil(fraction * len(group)))
+        selected += list(rng.choice(group['file'].to_numpy(), size=n_keep, replace=False))
+    return sorted(selected)
+
+def preview_path(path):
+    """
+    Marks an output path as a preview, e.g. cleaned.xlsx -> cleaned_preview.xlsx.
+    """
+    base, ext = os.path.splitext(path)
+    return f"{base}_preview{ext}"
+
+def read_trait_file(filename, traits=None):
+    """
+    Reads a single raw trait file and tags every row with its plot number.
+    Excel, CSV, TSV and Parquet files are supported; CSV/TSV are parsed with
+    the pyarrow engine.
+
+    Parameters:
+    - filename (str): Path to the raw trait file.
+    - traits (list): Trait columns to read. If None, all columns are read.
+
+    Returns:
+    - pd.DataFrame: Trait rows with a 'plot_number' column.
+    """
+    fmt = detect_format(filename)
+    usecols = list(traits) if traits is not None else None
+
+    if fmt in ('csv', 'tsv'):
+        sep = '\t' if fmt == 'tsv' else ','
+        df_temp = pd.read_csv(filename, sep=sep, engine='pyarrow', usecols=usecols)
+        # pyarrow leaves a blank header for a saved index; match read_excel's name
+        df_temp = df_temp.rename(columns={'': 'Unnamed: 0'})
+    elif fmt == 'parquet':
+        df_temp = pd.read_parquet(filename, columns=usecols)
+    elif fmt == 'excel':
+        df_temp = pd.read_excel(filename, usecols=usecols)
+    else:
+        raise ValueError(f"Unsupported raw file format: {filename}")
+
+    df_temp['plot_number'] = plot_number_from_filename(filename)
+    return df_temp
+
+def _file_key(filename, traits=None):
+    st = os.stat(filename)
+    return (os.path.abspath(filename), st.st_mtime_ns, st.st_size,
+            tuple(traits) if traits is not None else None)
+
+def load_trait_files(file_list, executor=None, traits=None):
+    """
+    Reads raw trait files through the parsed-file cache.
+    Files not yet cached are parsed on the executor when one is given.
+
+    Parameters:
+    - file_list (list): Paths of raw trait files.
+    - executor (Executor): Optional worker pool used to parse uncached files.
+    - traits (list): Trait columns to read. If None, all columns are read.
+
+    Returns:
+    - list: One DataFrame per file, in the order of file_list.
+    """
+    keys = [_file_key(f, traits) for f in file_list]
+    missing = {k: f for k, f in zip(keys, file_list) if k not in _RAW_CACHE}
+
+    reader = functools.partial(read_trait_file, traits=traits)
+    if executor is not None and len(missing) > 1:
+        parsed = executor.map(reader, list(missing.values()))
+    else:
+        parsed = map(reader, missing.values())
+    for key, df_temp in zip(missing.keys(), parsed):
+        _RAW_CACHE[key] = df_temp
 
-    for filename in file_list:
-        df_temp = pd.read_excel(filename)
-        base = os.path.basename(filename).rsplit('.', 1)[0]
+    return [_RAW_CACHE[k] for k in keys]
 
-        # find all digit-runs, pick the longest (e.g. "1104" over "1")
-        nums = re.findall(r'\d+', base)
-        if not nums:
-            raise ValueError(f"Could not extract any digits from filename: {base}")
-        plot_number = max(nums, key=len)
+def combine_plots(file_pattern, metadata_path, executor=None, traits=None, preview=None, seed=0):
+    """
+    Combines multiple raw trait files (Excel, CSV, TSV or Parquet) into plot-level rows.
+    Averages numeric trait columns by plot and merges with metadata.
+
+    Parameters:
+    - file_pattern (str): Glob pattern to find all relevant raw files.
+    - metadata_path (str): Path to the Excel metadata file.
+    - executor (Executor): Optional worker pool used to parse the raw files.
+    - traits (list): Trait columns to read. If None, all columns are read.
+    - preview (float): Optional fraction of files to read, stratified by Genotype x Condition.
+    - seed (int): Random seed for the preview subset.
 
-        df_temp['plot_number'] = plot_number
-        data_frames.append(df_temp)
+    Returns:
+    - pd.DataFrame: One row per plot with 'plot_number', trait columns, 'Genotype' and 'Condition'.
+    """
+    metadata_long = load_metadata(metadata_path)
+    file_list = list_raw_files(file_pattern)
+    if preview is not None:
+        file_list = select_preview_files(file_list, metadata_long, preview, seed=seed)
+    data_frames = load_trait_files(file_list, executor, traits=traits)
 
     if not data_frames:
         raise ValueError("No files found matching the pattern: " + file_pattern)
@@ -107,18 +280,42 @@ def combine_excels(file_pattern, metadata_path):
     averaged_df = combined_df.groupby('plot_number', as_index=False)[numeric_cols].mean()
 
     # merge with metadata
-    metadata_df  = pd.read_excel(metadata_path)
-    metadata_long = process_metadata(metadata_df)
-    metadata_long['Genotype'] = metadata_long['Genotype'].str.replace('.', '', regex=False)
-
     merged_df = pd.merge(averaged_df,
                          metadata_long,
                          on='plot_number',
                          how='left')
+    return merged_df
+
+def average_by_genotype(merged_df):
+    """
+    Averages plot-level trait values by Genotype and Condition.
 
+    Parameters:
+    - merged_df (pd.DataFrame): Plot-level rows as returned by combine_plots.
+
+    Returns:
+    - pd.DataFrame: One row per Genotype (and Condition) with mean trait values.
+    """
+    numeric_cols = merged_df.select_dtypes(include='number').columns.tolist()
     group_cols = ['Genotype'] + (['Condition'] if 'Condition' in merged_df.columns else [])
-    final_df = merged_df.groupby(group_cols, as_index=False)[numeric_cols].mean()
-    return final_df
+    return merged_df.groupby(group_cols, as_index=False)[numeric_cols].mean()
+
+def combine_excels(file_pattern, metadata_path, executor=None, traits=None):
+    """
+    Combines multiple raw trait files into a single cleaned DataFrame.
+    Averages numeric trait columns by plot, merges with metadata,
+    and computes average trait values grouped by Genotype and Condition.
+
+    Parameters:
+    - file_pattern (str): Glob pattern to find all relevant raw files (Excel, CSV, TSV or Parquet).
+    - metadata_path (str): Path to the Excel metadata file.
+    - executor (Executor): Optional worker pool used to parse the raw files.
+    - traits (list): Trait columns to read. If None, all columns are read.
+
+    Returns:
+    - pd.DataFrame: Merged and averaged DataFrame ready for scaling/cleaning.
+    """
+    return average_by_genotype(combine_plots(file_pattern, metadata_path, executor=executor, traits=traits))
 
 def scale_factor(df):
     """
@@ -154,50 +351,199 @@ def replace_outliers_iqr(df, k=1.5, winsorise=True):
     Returns:
     - pd.DataFrame: DataFrame with outliers handled.
     """
-    df_out = df.copy()
-    numeric_cols = df_out.select_dtypes(include='number').columns
-    for col in numeric_cols:
-        q1 = df_out[col].quantile(0.25)
-        q3 = df_out[col].quantile(0.75)
+    # build only the replaced columns; assign shares the untouched ones with df
+    handled = {}
+    for col in df.select_dtypes(include='number').columns:
+        q1, q3 = df[col].quantile([0.25, 0.75])
         iqr = q3 - q1
         lower = q1 - k * iqr
         upper = q3 + k * iqr
         if winsorise:
-            df_out[col] = df_out[col].clip(lower, upper)
+            handled[col] = df[col].clip(lower, upper)
         else:
-            df_out.loc[(df_out[col] < lower) | (df_out[col] > upper), col] = np.nan
-    return df_out
+            handled[col] = df[col].mask((df[col] < lower) | (df[col] > upper))
+    return df.assign(**handled)
 
-def run_pipeline(input_dir, metadata_path, output_name):
+def run_pipeline(input_dir, metadata_path, output_name, executor=None,
+                 plot_store=None, experiment=None, traits=None, preview=None, seed=0, save=True):
     """
     Runs the full data preparation pipeline:
-    - Combines raw Excel files
+    - Combines raw trait files (Excel, CSV, TSV or Parquet)
     - Scales specific traits
+    - Optionally saves the scaled plot-level rows to a partitioned store
     - Handles outliers
     - Saves cleaned output
 
     Parameters:
-    - input_dir (str): Directory containing input Excel files.
+    - input_dir (str): Directory containing raw trait files.
     - metadata_path (str): Path to metadata Excel file.
     - output_name (str): Path to save cleaned output Excel file.
+    - executor (Executor): Optional worker pool used to parse the raw files.
+    - plot_store (str): Optional folder for the plot-level Parquet store.
+    - experiment (str): Experiment name; partitions the plot store by Experiment when given.
+    - traits (list): Trait columns to read. If None, all columns are read.
+    - preview (float): Optional fraction of raw files to use for a quick look. Outputs
+      get a '_preview' suffix so they are never mistaken for the full run.
+    - seed (int): Random seed for the preview subset.
+    - save (bool): If False, the cleaned output is returned but not written
+      (run_batch writes all workbooks together).
+
+    Returns:
+    - pd.DataFrame: The cleaned dataset.
     """
-    file_pattern = os.path.join(input_dir, '*.xlsx')
-    df = combine_excels(file_pattern, metadata_path)
-    df_scaled = scale_factor(df)
+    if preview is not None:
+        output_name = preview_path(output_name)
+        plot_store = preview_path(plot_store) if plot_store else None
+
+    file_pattern = os.path.join(input_dir, '*')
+    # scaling is linear, so scaling plots before averaging matches scaling the means
+    df_plots = scale_factor(combine_plots(file_pattern, metadata_path, executor=executor, traits=traits,
+                                          preview=preview, seed=seed))
+    if plot_store:
+        if experiment is not None:
+            df_plots.insert(0, 'Experiment', experiment)
+        write_plot_store(df_plots, plot_store)
+        print(f"Saved plot-level store to: {plot_store}")
+    df_scaled = average_by_genotype(df_plots)
     df_cleaned = replace_outliers_iqr(df_scaled, k=1.5, winsorise=True)
-    df_cleaned.to_excel(output_name, index=False)
-    print(f"Saved cleaned dataset to: {output_name}")
+    if save:
+        write_excel(df_cleaned, output_name)
+        report_saved(output_name, preview, seed)
+    return df_cleaned
+
+def report_saved(output_name, preview=None, seed=0):
+    """
+    Prints where a cleaned dataset was saved, marking preview outputs.
+    """
+    if preview is not None:
+        print(f"[PREVIEW {preview:.0%} of raw files, seed {seed}] Saved provisional cleaned dataset to: {output_name}")
+    else:
+        print(f"Saved cleaned dataset to: {output_name}")
+
+def load_batch_config(config_path):
+    """
+    Reads a YAML batch config listing the experiments to clean.
+
+    Expected layout:
+        experiments:
+          - name: arizona_2024
+            input_dir: data/arizona/raw
+            metadata: data/arizona/meta.xlsx
+
+    Parameters:
+    - config_path (str): Path to the YAML config.
+
+    Returns:
+    - list: One dict per experiment with 'name', 'input_dir' and 'metadata'.
+    """
+    import yaml
+
+    with open(config_path) as fh:
+        config = yaml.safe_load(fh) or {}
+
+    base_dir = os.path.dirname(os.path.abspath(config_path))
+    experiments = []
+    for entry in config.get('experiments', []):
+        missing = [k for k in ('name', 'input_dir', 'metadata') if k not in entry]
+        if missing:
+            raise ValueError(f"Batch entry {entry} is missing: {', '.join(missing)}")
+        experiments.append({
+            'name': str(entry['name']),
+            'input_dir': os.path.join(base_dir, entry['input_dir']),
+            'metadata': os.path.join(base_dir, entry['metadata']),
+        })
+
+    if not experiments:
+        raise ValueError(f"No experiments listed in batch config: {config_path}")
+    return experiments
+
+def run_batch(experiments, output_dir, combined_output=None, workers=None, plot_store=None, traits=None,
+              preview=None, seed=0):
+    """
+    Cleans several experiments in one invocation.
+    Raw files of every experiment are parsed on one shared worker pool,
+    then each experiment is cleaned and saved as <output_dir>/<name>_cleaned.xlsx.
+    The workbooks are written concurrently on the same pool.
+
+    Parameters:
+    - experiments (list): Dicts with 'name', 'input_dir' and 'metadata'.
+    - output_dir (str): Folder to save the per-experiment cleaned files.
+    - combined_output (str): Optional path for the combined table, tagged with a 'Region' column.
+    - workers (int): Number of worker processes (defaults to the CPU count).
+    - plot_store (str): Optional folder for a plot-level store partitioned by Experiment and Condition.
+    - traits (list): Trait columns to read. If None, all columns are read.
+    - preview (float): Optional fraction of raw files per experiment to use for a quick look.
+    - seed (int): Random seed for the preview subset.
+
+    Returns:
+    - pd.DataFrame: All cleaned experiments stacked, with a 'Region' column.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # parse everything up front so the pool is shared across experiments
+        all_files = []
+        for exp in experiments:
+            file_list = list_raw_files(os.path.join(exp['input_dir'], '*'))
+            if preview is not None:
+                file_list = select_preview_files(file_list, load_metadata(exp['metadata']), preview, seed=seed)
+            all_files += file_list
+        load_trait_files(all_files, executor, traits=traits)
+
+        cleaned, jobs = [], []
+        for exp in experiments:
+            output_name = os.path.join(output_dir, f"{exp['name']}_cleaned.xlsx")
+            if preview is not None:
+                output_name = preview_path(output_name)
+            df_cleaned = run_pipeline(exp['input_dir'], exp['metadata'], output_name, executor=executor,
+                                      plot_store=plot_store, experiment=exp['name'], traits=traits,
+                                      preview=preview, seed=seed, save=False)
+            jobs.append((df_cleaned, output_name))
+            tagged = df_cleaned.copy(deep=False)
+            tagged.insert(0, 'Region', exp['name'])
+            cleaned.append(tagged)
+
+        combined_df = pd.concat(cleaned, ignore_index=True)
+        if combined_output:
+            if preview is not None:
+                combined_output = preview_path(combined_output)
+            jobs.append((combined_df, combined_output))
+
+        written = write_workbooks(jobs, executor)
+
+    for path in written[:len(experiments)]:
+        report_saved(path, preview, seed)
+    if combined_output:
+        print(f"Saved combined dataset to: {combined_output}")
+    return combined_df
 
 def parse_args():
     """
     Parses command-line arguments for the data processing pipeline.
     """
-    p = argparse.ArgumentParser(description="Combine, scale, and clean trait Excel files using metadata.")
-    p.add_argument('--input-dir', default='data/raw', help="Folder containing raw Excel trait files")
+    p = argparse.ArgumentParser(description="Combine, scale, and clean raw trait files using metadata.")
+    p.add_argument('--input-dir', default='data/raw', help="Folder containing raw trait files (Excel, CSV, TSV or Parquet)")
     p.add_argument('--metadata',  default='data/meta.xlsx', help="Metadata file (Excel)")
     p.add_argument('--output',    default="/srv/data/cleaned.xlsx", help="Path to save the final cleaned file")
+    p.add_argument('--traits',    nargs='+', help="Only read these trait columns from the raw files (default: all)")
+    p.add_argument('--plot-store', help="Folder for a plot-level Parquet store partitioned by Condition")
+    p.add_argument('--preview',   type=float, metavar='FRACTION',
+                   help="Quick look on this fraction of raw files, stratified by Genotype x Condition; outputs get a _preview suffix")
+    p.add_argument('--seed',      type=int, default=0, help="Random seed for --preview")
+    p.add_argument('--batch',     help="YAML config listing several experiments to clean in one run")
+    p.add_argument('--output-dir', default="/srv/data/cleaned", help="Folder for per-experiment cleaned files (batch mode)")
+    p.add_argument('--combined-output', help="Path to save all experiments stacked with a Region column (batch mode)")
+    p.add_argument('--workers',   type=int, help="Number of worker processes (batch mode, default: CPU count)")
     return p.parse_args()
 
 if __name__ == '__main__':
     args = parse_args()
-    run_pipeline(args.input_dir, args.metadata, args.output)
+    if args.batch:
+        run_batch(load_batch_config(args.batch), args.output_dir,
+                  combined_output=args.combined_output, workers=args.workers,
+                  plot_store=args.plot_store, traits=args.traits,
+                  preview=args.preview, seed=args.seed)
+    else:
+        run_pipeline(args.input_dir, args.metadata, args.output,
+                     plot_store=args.plot_store, traits=args.traits,
+                     preview=args.preview, seed=args.seed)
@@ -4,20 +4,23 @@ import plotly.express as px
 from plotly.subplots import make_subplots
 import plotly.graph_objects as go
 import math
+from excel_export import read_excel_sheets
+from trait_tensor import as_frame, load_table
 
-def plot_traits_grid(df, traits=None, cols=2, out_html=None):
+def plot_traits_grid(df, traits=None, cols=2, out_html=None, significance=None):
     """
     Generates a grid of grouped bar charts comparing specified traits
     across genotypes and conditions (e.g., HI vs LI).
 
     Parameters:
-    - df (pd.DataFrame): DataFrame containing trait data with 'Genotype' and 'Condition'.
+    - df (pd.DataFrame | TraitTensor): Trait data with 'Genotype' and 'Condition'.
     - traits (list): List of trait names to include. If None, all numeric traits are used.
     - cols (int): Number of columns in the grid layout.
     - out_html (str): Path to save the output image (HTML).
+    - significance (pd.DataFrame): Optional results from significance.py; genotype/trait pairs
+      marked 'Significant' get a '*' above their bars.
     """
-    df = df.copy()
-    df = df.drop(columns=['Unnamed: 0'], errors='ignore')
+    df = as_frame(df).drop(columns=['Unnamed: 0'], errors='ignore')
 
     if traits is None:
         ignore_cols = {'Genotype', 'Condition'}
@@ -48,6 +51,23 @@ def plot_traits_grid(df, traits=None, cols=2, out_html=None):
                 row=row, col=col
             )
 
+        if significance is not None:
+            sig = significance[(significance['Trait'] == trait) & significance['Significant']]
+            tops = df_avg.groupby('Genotype')[trait].max()
+            tops = tops[tops.index.isin(sig['Genotype'])]
+            fig.add_trace(
+                go.Scatter(
+                    x=tops.index,
+                    y=tops.values * 1.05,
+                    mode='text',
+                    text=['*'] * len(tops),
+                    textfont=dict(size=16),
+                    showlegend=False,
+                    hoverinfo='skip'
+                ),
+                row=row, col=col
+            )
+
     fig.update_layout(
         height=300 * rows,
         title_text="Trait Comparison by Genotype and Treatment",
@@ -66,7 +86,10 @@ def plot_traits_grid(df, traits=None, cols=2, out_html=None):
 def compare_two_locations(df1, df2, traits=None, cols=2, out_html=None):
     """
     Places two trait‐grid plots side by side for location1 vs location2.
+    Each location may be a DataFrame or a TraitTensor.
     """
+    df1 = as_frame(df1)
+    df2 = as_frame(df2)
     if traits is None:
         traits = [
             c for c in df1.select_dtypes(include='number').columns
@@ -137,24 +160,55 @@ def compare_two_locations(df1, df2, traits=None, cols=2, out_html=None):
 
 def main():
     p = argparse.ArgumentParser(description="Grid plot of traits by genotype and condition (1 or 2 locations)")
-    p.add_argument('--inputs',nargs='+',required=True, help='One or two cleaned Excel input files')
+    p.add_argument('--inputs',nargs='+',required=True, help='One or two cleaned Excel files or tensor folders, or one combined file with a Region column')
     p.add_argument('--output', required=True, help='Path to save output image (HTML)')
     p.add_argument('--traits',nargs='+',help='List of traits to include (default: all numeric traits)')
     p.add_argument('--cols',type=int,default=2,help='Number of columns in the grid layout (per location)')
+    p.add_argument('--significance', help='Results Excel file from significance.py, used to mark significant bars')
+    p.add_argument('--regions',nargs=2,metavar=('REGION1','REGION2'),help='Two regions to compare from a combined file with a Region column')
     args = p.parse_args()
 
+    if args.regions and len(args.inputs) != 1:
+        p.error("--regions only applies to a single combined --inputs file")
+
     if len(args.inputs) == 1:
-        df = pd.read_excel(args.inputs[0])
+        df = as_frame(load_table(args.inputs[0]))
+
+        # combined batch output: one file holding the locations side by side
+        if 'Region' in df.columns:
+            regions = args.regions or list(df['Region'].dropna().unique())
+            if len(regions) != 2:
+                p.error(f"{args.inputs[0]} holds {len(regions)} regions ({', '.join(map(str, regions))}); "
+                        "choose two with --regions")
+            missing = [r for r in regions if r not in set(df['Region'])]
+            if missing:
+                p.error(f"Region(s) not found in {args.inputs[0]}: {', '.join(missing)}")
+            if args.significance:
+                p.error("--significance only applies to a single location")
+            df1, df2 = [df[df['Region'] == r].drop(columns='Region') for r in regions]
+            compare_two_locations(
+                df1,
+                df2,
+                traits=args.traits,
+                out_html=args.output
+            )
+            return
+
+        if args.regions:
+            p.error(f"--regions needs a Region column in {args.inputs[0]}")
         plot_traits_grid(
             df,
             traits=args.traits,
             cols=args.cols,
-            out_html=args.out
+            out_html=args.output,
+            significance=read_excel_sheets(args.significance) if args.significance else None
         )
 
     elif len(args.inputs) == 2:
-        df1 = pd.read_excel(args.inputs[0])
-        df2 = pd.read_excel(args.inputs[1])
+        if args.significance:
+            p.error("--significance only applies to a single location")
+        df1 = as_frame(load_table(args.inputs[0]))
+        df2 = as_frame(load_table(args.inputs[1]))
         compare_two_locations(
             df1,
             df2,
@@ -0,0 +1,119 @@
+import numpy as np
+import pandas as pd
+import xlsxwriter
+
+# rows per worksheet in .xlsx, including the header row
+EXCEL_MAX_ROWS = 1048576
+EXCEL_MAX_SHEET_NAME = 31
+
+def sheet_part_names(sheet_name, n_parts):
+    """
+    Names of the worksheets one table is split across: the first keeps
+    sheet_name, the rest get a '_2', '_3', ... suffix (trimmed to Excel's 31 characters).
+    """
+    names = [sheet_name[:EXCEL_MAX_SHEET_NAME]]
+    for part in range(2, n_parts + 1):
+        suffix = f"_{part}"
+        names.append(sheet_name[:EXCEL_MAX_SHEET_NAME - len(suffix)] + suffix)
+    return names
+
+def read_excel_sheets(path, sheet_name=0):
+    """
+    Reads a table written by write_excel, joining the continuation sheets
+    (Sheet1_2, Sheet1_3, ...) that hold rows past the Excel row limit.
+
+    Parameters:
+    - path (str): .xlsx path.
+    - sheet_name (str | int): Sheet name, or position of the first sheet of the table.
+
+    Returns:
+    - pd.DataFrame: All rows of the table.
+    """
+    with pd.ExcelFile(path) as xls:
+        if isinstance(sheet_name, int):
+            sheet_name = xls.sheet_names[sheet_name]
+        parts = [sheet_name]
+        for name in sheet_part_names(sheet_name, len(xls.sheet_names) + 1)[1:]:
+            if name not in xls.sheet_names:
+                break
+            parts.append(name)
+        frames = [xls.parse(name) for name in parts]
+    if len(frames) == 1:
+        return frames[0]
+    return pd.concat(frames, ignore_index=True)
+
+def _write_sheet(workbook, df, sheet_name, header_format, chunk_rows, max_rows):
+    rows_per_sheet = max_rows - 1
+    n_parts = max(1, -(-len(df) // rows_per_sheet))
+    columns = [str(c) for c in df.columns]
+
+    for part, name in enumerate(sheet_part_names(sheet_name, n_parts)):
+        worksheet = workbook.add_worksheet(name)
+        worksheet.write_row(0, 0, columns, header_format)
+        first = part * rows_per_sheet
+        last = min(first + rows_per_sheet, len(df))
+        # rows go out in order and in chunks, so only one chunk is ever converted
+        for start in range(first, last, chunk_rows):
+            block = df.iloc[start:min(start + chunk_rows, last)]
+            # np.where returns a fresh array; to_numpy can hand back a read-only view
+            values = np.where(block.isna().to_numpy(), None, block.to_numpy(dtype=object))
+            # xlsxwriter has no number for +/-inf; write them as text like to_excel does
+            values[block.isin([np.inf]).to_numpy()] = 'inf'
+            values[block.isin([-np.inf]).to_numpy()] = '-inf'
+            for offset, row in enumerate(values, start=start - first + 1):
+                worksheet.write_row(offset, 0, row)
+
+def write_excel(sheets, path, sheet_name='Sheet1', chunk_rows=10000, max_rows=EXCEL_MAX_ROWS):
+    """
+    Writes one or more DataFrames to an .xlsx workbook with xlsxwriter's
+    constant-memory mode: rows are flushed to disk as they are written, so
+    memory does not grow with the table. Tables longer than the Excel row
+    limit continue on extra sheets (Sheet1, Sheet1_2, ...). The index is not written.
+
+    Parameters:
+    - sheets (pd.DataFrame | dict): A single table, or sheet name -> table.
+    - path (str): Output .xlsx path.
+    - sheet_name (str): Sheet name used when a single table is given.
+    - chunk_rows (int): Rows converted from the DataFrame at a time.
+    - max_rows (int): Rows per sheet including the header (Excel's limit by default).
+
+    Returns:
+    - str: The path that was written.
+    """
+    if isinstance(sheets, pd.DataFrame):
+        sheets = {sheet_name: sheets}
+
+    workbook = xlsxwriter.Workbook(path, {
+        'constant_memory': True,
+        'strings_to_urls': False,
+        'strings_to_formulas': False,
+        'default_date_format': 'yyyy-mm-dd hh:mm:ss',
+    })
+    # same header look as DataFrame.to_excel
+    header_format = workbook.add_format({'bold': True, 'border': 1, 'align': 'center', 'valign': 'top'})
+    try:
+        for name, df in sheets.items():
+            _write_sheet(workbook, df, name, header_format, chunk_rows, max_rows)
+    finally:
+        workbook.close()
+    return path
+
+def _write_job(job):
+    sheets, path = job
+    return write_excel(sheets, path)
+
+def write_workbooks(jobs, executor=None):
+    """
+    Writes several workbooks, concurrently when an executor is given.
+
+    Parameters:
+    - jobs (list): (DataFrame or sheet name -> DataFrame dict, path) pairs.
+    - executor (Executor): Optional worker pool; a process pool lets workbooks
+      be written in parallel since xlsxwriter runs in pure Python.
+
+    Returns:
+    - list: The written paths, in the order of jobs.
+    """
+    if executor is not None and len(jobs) > 1:
+        return list(executor.map(_write_job, jobs))
+    return [_write_job(job) for job in jobs]
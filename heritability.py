@@ -2,6 +2,7 @@ import argparse
 import pandas as pd
 import numpy as np
 import plotly.express as px
+from trait_tensor import TraitTensor, load_table
 
 def normalize_condition_labels(df):
     mapping = {
@@ -14,14 +15,17 @@ def normalize_condition_labels(df):
         'wl': 'LI',
         'li': 'LI'
     }
-    df['Condition'] = (
-        df['Condition']
+    # clean each distinct label once, then expand back to the rows
+    codes, labels = pd.factorize(df['Condition'], use_na_sentinel=False)
+    labels = (
+        pd.Series(labels)
         .astype(str)
         .str.lower()
         .str.strip()
         .replace(mapping)
         .str.upper()
     )
+    df['Condition'] = labels.take(codes).set_axis(df.index)
     return df
 
 
@@ -30,15 +34,18 @@ def get_statistics(df, treat_label=None, n_replicates=80):
     Computes statistical metrics for each numeric trait including estimated heritability (H2).
 
     Parameters:
-    - df (pd.DataFrame): Input data containing numeric traits.
+    - df (pd.DataFrame | TraitTensor): Input data containing numeric traits.
     - treat_label (str): Label to indicate treatment group (e.g., 'HI', 'LI'). Defaults to 'Overall'.
     - n_replicates (int): Number of replicates used to compute error and genetic variance.
 
     Returns:
     - pd.DataFrame: DataFrame with statistical values per trait including heritability.
     """
-    df = df.drop(columns=['Unnamed: 0'], errors='ignore')
-    df_numeric = df.select_dtypes(include='number')
+    if isinstance(df, TraitTensor):
+        df_numeric = df.trait_frame()
+    else:
+        df = df.drop(columns=['Unnamed: 0'], errors='ignore')
+        df_numeric = df.select_dtypes(include='number')
 
     stats = {
         'Trait': [], 'Variance': [], 'Mean': [], 'Standard Deviation': [],
@@ -80,24 +87,29 @@ def plot_heritability(
     Generates bar plots of heritability (H2) by trait, optionally split by treatment.
 
     Parameters:
-    - input_file (str): Path to Excel file containing cleaned data.
+    - input_file (str): Path to Excel file containing cleaned data, or a tensor folder.
     - out_html (str): Path to save output HTML file.
     - separate_by_treat (bool): Whether to generate separate bars for 'HI' and 'LI'.
     - show_error (bool): Whether to include error bars based on error variance.
     - max_error (float): Maximum error bar value (for clipping).
     """
-    df = pd.read_excel(input_file)
-    df = normalize_condition_labels(df)
+    data = load_table(input_file)
 
     if separate_by_treat:
-        df_hi = df[df['Condition'] == 'HI']
-        df_li = df[df['Condition'] == 'LI']
+        if isinstance(data, TraitTensor):
+            # label slices are views of the memory-mapped tensor
+            df_hi = data.sel(condition='HI')
+            df_li = data.sel(condition='LI')
+        else:
+            df = normalize_condition_labels(data)
+            df_hi = df[df['Condition'] == 'HI']
+            df_li = df[df['Condition'] == 'LI']
 
         stats_hi = get_statistics(df_hi, treat_label='HI')
         stats_li = get_statistics(df_li, treat_label='LI')
         stats_df = pd.concat([stats_hi, stats_li], ignore_index=True)
     else:
-        stats_df = get_statistics(df)
+        stats_df = get_statistics(data)
 
     stats_df['Ve (Error Variance)'] = stats_df['Ve (Error Variance)'].clip(upper=max_error)
     error_kwargs = {'error_y': 'Ve (Error Variance)'} if show_error else {}
@@ -126,7 +138,7 @@ def main():
     Command-line interface for heritability analysis and visualization.
     """
     parser = argparse.ArgumentParser(description="Generate heritability bar plots.")
-    parser.add_argument("--input", default="/srv/data/cleaned.xlsx", help="Path to cleaned Excel file (e.g. cleaned.xlsx)")
+    parser.add_argument("--input", default="/srv/data/cleaned.xlsx", help="Path to cleaned Excel file (e.g. cleaned.xlsx) or tensor folder")
     parser.add_argument("--output", default="/srv/data/heritability.html", help="Output plot image file (e.g. heritability.html)")
     parser.add_argument("--separate-by-treat", action="store_true", help="Plot HI vs LI side-by-side")
     parser.add_argument("--show-error", action="store_true", help="Show error bars")
@@ -2,6 +2,7 @@ import argparse
 import pandas as pd
 import plotly.express as px
 import os
+from trait_tensor import as_frame, load_table
 
 def normalize_condition_labels(df):
     mapping = {
@@ -14,38 +15,57 @@ def normalize_condition_labels(df):
         'wl': 'LI',
         'li': 'LI'
     }
-    df['Condition'] = (
-        df['Condition']
+    # clean each distinct label once, then expand back to the rows
+    codes, labels = pd.factorize(df['Condition'], use_na_sentinel=False)
+    labels = (
+        pd.Series(labels)
         .astype(str)
         .str.lower()
         .str.strip()
         .replace(mapping)
         .str.upper()
     )
+    df['Condition'] = labels.take(codes).set_axis(df.index)
     return df
 
-def prepare_fully_scaled_data(df, scale='zscore'):
+def scale_traits(df, scale='zscore'):
     """
-    Prepares and reshapes the data for plotting by scaling numeric traits
-    using either z-score or min-max normalization.
+    Scales numeric trait columns using either z-score or min-max normalization.
 
     Parameters:
-    - df (pd.DataFrame): Input DataFrame with raw trait values.
+    - df (pd.DataFrame | TraitTensor): Input data with raw trait values.
     - scale (str): 'zscore' or 'minmax' scaling method.
 
     Returns:
-    - pd.DataFrame: Long-form DataFrame with scaled trait values.
+    - pd.DataFrame: Wide DataFrame with scaled trait values.
     """
-    df = df.drop(columns=['Unnamed: 0', 'plot_number'], errors='ignore')
+    df = as_frame(df).drop(columns=['Unnamed: 0', 'plot_number'], errors='ignore')
 
     trait_cols = df.select_dtypes(include='number').columns.tolist()
 
+    # vectorized per column and assigned directly, so no intermediate
+    # trait x row frame is built
     if scale == 'zscore':
-        df[trait_cols] = df[trait_cols].apply(lambda x: (x - x.mean()) / x.std())
+        scaled = {c: (df[c] - df[c].mean()) / df[c].std() for c in trait_cols}
     elif scale == 'minmax':
-        df[trait_cols] = df[trait_cols].apply(lambda x: (x - x.min()) / (x.max() - x.min()))
+        scaled = {c: (df[c] - df[c].min()) / (df[c].max() - df[c].min()) for c in trait_cols}
     else:
         raise ValueError("scale must be 'zscore' or 'minmax'")
+    return df.assign(**scaled)
+
+def prepare_fully_scaled_data(df, scale='zscore'):
+    """
+    Prepares and reshapes the data for plotting by scaling numeric traits
+    using either z-score or min-max normalization.
+
+    Parameters:
+    - df (pd.DataFrame | TraitTensor): Input data with raw trait values.
+    - scale (str): 'zscore' or 'minmax' scaling method.
+
+    Returns:
+    - pd.DataFrame: Long-form DataFrame with scaled trait values.
+    """
+    df = scale_traits(df, scale=scale)
 
     df_long = df.melt(
         id_vars=['Genotype', 'Condition'],
@@ -127,7 +147,7 @@ def main():
     with optional highlighting of the most variable ones.
     """
     p = argparse.ArgumentParser(description="Line plot of scaled trait values across genotypes.")
-    p.add_argument('--input', default="/srv/data/cleaned.xlsx", help='Cleaned Excel input file')
+    p.add_argument('--input', default="/srv/data/cleaned.xlsx", help='Cleaned Excel input file or tensor folder')
     p.add_argument('--output', default="/srv/data/line.html", help='Path to save plot HTML')
     p.add_argument('--top', type=int, help='Highlight top N most variable genotypes')
     p.add_argument('--scale', choices=['zscore', 'minmax'], default='zscore', help='Scaling method for traits')
@@ -135,7 +155,7 @@ def main():
 
     args = p.parse_args()
 
-    df = pd.read_excel(args.input)
+    df = as_frame(load_table(args.input))
     df = normalize_condition_labels(df)
     df_long = prepare_fully_scaled_data(df, scale=args.scale)
 
@@ -1,6 +1,7 @@
 import argparse
 import pandas as pd
 import plotly.express as px
+from excel_export import read_excel_sheets
 
 def load_and_prepare_data(file_path):
     """
@@ -12,7 +13,7 @@ def load_and_prepare_data(file_path):
     Returns:
     - pd.DataFrame: DataFrame containing only numeric trait columns.
     """
-    df = pd.read_excel(file_path)
+    df = read_excel_sheets(file_path)
     cols_to_drop = ['file_name', 'Unnamed: 0', 'Replicate', 'Plot_Number', 'Genotype', 'plot_number', 'filename', 'Condition']
     df_numeric = df.drop(columns=cols_to_drop, errors='ignore')
     return df_numeric
@@ -21,6 +21,7 @@ mkdir -p "${HOST_DATA_DIR}"
 
 # 3️⃣ Decide what to run:
 #    - no args      → clean
+#    - preview [F]  → clean a fraction F of raw files (default 0.1) and draw quick-look plots
 #    - first arg .py → run that script
 if [[ $# -eq 0 ]]; then
   MODE="clean"
@@ -29,6 +30,10 @@ else
   if [[ "${FIRST}" == "clean" ]]; then
     MODE="clean"
     shift
+  elif [[ "${FIRST}" == "preview" ]]; then
+    MODE="preview"
+    FRACTION="${2:-0.1}"
+    shift
   elif [[ "${FIRST}" == *.py ]]; then
     MODE="run"
     SCRIPT="${FIRST}"
@@ -38,6 +43,7 @@ else
     echo "Usage:"
     echo "  $0            # clean"
     echo "  $0 clean      # same as no args"
+    echo "  $0 preview [FRACTION]  # quick look on a sample of raw files (default 0.1)"
     echo "  $0 script.py  # run any Python script"
     exit 1
   fi
@@ -57,6 +63,33 @@ case "${MODE}" in
     echo "✅ cleaned → ./data/cleaned.xlsx"
     ;;
 
+  preview)
+    echo "👀 [preview] Cleaning ${FRACTION} of raw files per Genotype × Condition…"
+    docker run --rm \
+      -v "${HOST_DATA_DIR}:${CTR_DATA_DIR}" \
+      "${IMAGE_NAME}" \
+      combine_and_clean_data.py \
+        --input-dir "${CTR_DATA_DIR}/raw" \
+        --metadata "${CTR_DATA_DIR}/meta.xlsx" \
+        --output "${CTR_DATA_DIR}/cleaned.xlsx" \
+        --preview "${FRACTION}"
+    for SCRIPT in mean_median.py heritability.py line.py; do
+      EXTRA=()
+      if [[ "${SCRIPT}" == "line.py" ]]; then
+        EXTRA=(--region "PREVIEW")
+      fi
+      docker run --rm \
+        -v "${HOST_DATA_DIR}:${CTR_DATA_DIR}" \
+        "${IMAGE_NAME}" \
+        "${SCRIPT}" \
+          --input "${CTR_DATA_DIR}/cleaned_preview.xlsx" \
+          --output "${CTR_DATA_DIR}/${SCRIPT%.py}_preview.html" \
+          "${EXTRA[@]+"${EXTRA[@]}"}"
+    done
+    echo "⚠️  PREVIEW ONLY (${FRACTION} of raw files) → ./data/*_preview.*"
+    echo "   Review these, then run '$0' for the full dataset."
+    ;;
+
   run)
     echo "🚀 [run] ${SCRIPT} with args: $*"
     docker run --rm \
@@ -1,6 +1,10 @@
 import argparse
+import functools
+import os
 import pandas as pd
 import plotly.express as px
+from excel_export import read_excel_sheets
+from trait_store import read_plot_store
 
 def normalize_condition_labels(df):
     mapping = {
@@ -13,17 +17,55 @@ def normalize_condition_labels(df):
         'wl': 'LI',
         'li': 'LI'
     }
-    df['Condition'] = (
-        df['Condition']
+    # clean each distinct label once, then expand back to the rows
+    codes, labels = pd.factorize(df['Condition'], use_na_sentinel=False)
+    labels = (
+        pd.Series(labels)
         .astype(str)
         .str.lower()
         .str.strip()
         .replace(mapping)
         .str.upper()
     )
+    df['Condition'] = labels.take(codes).set_axis(df.index)
     return df
 
 
+@functools.lru_cache(maxsize=None)
+def _read_sheet(file_path, sheet_name):
+    return read_excel_sheets(file_path, sheet_name=sheet_name)
+
+def load_region_data(file_path, region_label=None, sheet_name="Sheet1", genotype=None, traits=None):
+    """
+    Loads a cleaned Excel file. When the file is a combined batch output with a
+    'Region' column, only the rows of the requested region are returned.
+    When file_path is a plot-level store folder, only the rows of the genotype
+    (and region, if the store is partitioned by Experiment) and the requested
+    trait columns are read from disk.
+
+    Parameters:
+    - file_path (str): Path to the Excel file or plot-level store folder.
+    - region_label (str): Region to select from a combined file or store.
+    - sheet_name (str): Sheet name in the Excel file.
+    - genotype (str): Genotype to read from a plot-level store.
+    - traits (list): Trait columns to read from a plot-level store.
+
+    Returns:
+    - pd.DataFrame: Cleaned rows for the region.
+    """
+    if os.path.isdir(file_path):
+        return read_plot_store(
+            file_path,
+            genotypes=[genotype] if genotype is not None else None,
+            experiments=[region_label] if region_label is not None else None,
+            traits=traits
+        )
+
+    df = _read_sheet(file_path, sheet_name)
+    if 'Region' in df.columns and region_label is not None:
+        df = df[df['Region'] == region_label].drop(columns='Region')
+    return df
+
 def compute_trait_by_region(file_path, trait, genotype, region_label="Region", sheet_name="Sheet1"):
     """
     Extracts and averages a single trait by condition for a specific genotype and region from an Excel file.
@@ -38,9 +80,9 @@ def compute_trait_by_region(file_path, trait, genotype, region_label="Region", s
     Returns:
     - pd.DataFrame: DataFrame with average trait values per condition, with region and genotype included.
     """
-    df = pd.read_excel(file_path, sheet_name=sheet_name)
+    df = load_region_data(file_path, region_label, sheet_name=sheet_name, genotype=genotype, traits=[trait])
     df = df[df['Genotype'] == genotype]
-    df = df[['Condition', trait]].copy()
+    df = df[['Condition', trait]]
     df[trait] = pd.to_numeric(df[trait], errors='coerce')
     df = df.dropna(subset=[trait])
     grouped = df.groupby('Condition', as_index=False).mean()
@@ -61,13 +103,26 @@ def compute_all_traits_by_region(file_path, genotype, region_label="Region", she
     Returns:
     - pd.DataFrame: DataFrame with average values of all traits per condition.
     """
-    df = pd.read_excel(file_path, sheet_name=sheet_name)
+    df = load_region_data(file_path, region_label, sheet_name=sheet_name, genotype=genotype)
     df = df[df['Genotype'] == genotype]
+    return summarize_by_condition(df, genotype, region_label=region_label)
 
+def summarize_by_condition(df, genotype, region_label="Region"):
+    """
+    Averages all numeric traits by condition for rows already filtered to one genotype.
+
+    Parameters:
+    - df (pd.DataFrame): Rows of a single genotype.
+    - genotype (str): Genotype label to attach.
+    - region_label (str): Region label to attach.
+
+    Returns:
+    - pd.DataFrame: DataFrame with average values of all traits per condition.
+    """
     non_traits = ['Condition', 'Genotype', 'Region', 'plot_number', 'Unnamed: 0']
     trait_cols = df.select_dtypes(include='number').columns.difference(non_traits)
 
-    df[trait_cols] = df[trait_cols].apply(pd.to_numeric, errors='coerce')
+    # trait_cols are numeric already, so no per-column conversion is needed
     df = df.dropna(subset=trait_cols, how='all')
 
     grouped = df.groupby('Condition', as_index=False)[trait_cols].mean()
@@ -75,15 +130,17 @@ def compute_all_traits_by_region(file_path, genotype, region_label="Region", she
     grouped['Genotype'] = genotype
     return grouped
 
-def plot_raw_trait(df, trait, genotype, out_html):
+def raw_trait_figure(df, trait, genotype):
     """
-    Plots a line chart of a single trait across conditions, colored by region.
+    Builds a line chart of a single trait across conditions, colored by region.
 
     Parameters:
     - df (pd.DataFrame): Combined DataFrame containing trait values.
     - trait (str): Trait to plot.
     - genotype (str): Genotype label to display in the title.
-    - out_html (str): Saves the plot to a HTML file.
+
+    Returns:
+    - plotly.graph_objects.Figure: The chart.
     """
     fig = px.line(
         df,
@@ -96,20 +153,35 @@ def plot_raw_trait(df, trait, genotype, out_html):
     )
     fig.update_xaxes(showticklabels=True, tickangle=45)
     fig.update_layout(template='plotly_white')
+    return fig
+
+def plot_raw_trait(df, trait, genotype, out_html):
+    """
+    Plots a line chart of a single trait across conditions, colored by region.
+
+    Parameters:
+    - df (pd.DataFrame): Combined DataFrame containing trait values.
+    - trait (str): Trait to plot.
+    - genotype (str): Genotype label to display in the title.
+    - out_html (str): Saves the plot to a HTML file.
+    """
+    fig = raw_trait_figure(df, trait, genotype)
     if out_html:
         fig.write_html(out_html)
         print(f"Saved plot to {out_html}")
     else:
         fig.show()
 
-def plot_all_traits(df, genotype, out_html):
+def all_traits_figure(df, genotype):
     """
-    Plots all traits in a faceted line chart, one subplot per trait.
+    Builds a faceted line chart of all traits, one subplot per trait.
 
     Parameters:
     - df (pd.DataFrame): Combined DataFrame of all traits.
     - genotype (str): Genotype label to display in the title.
-    - out_html (str): Saves the plot to a HTML file.
+
+    Returns:
+    - plotly.graph_objects.Figure: The chart.
     """
     val_cols = df.select_dtypes(include='number').columns.difference(['Region'])
     long_df = df.melt(
@@ -133,7 +205,18 @@ def plot_all_traits(df, genotype, out_html):
     fig.update_xaxes(showticklabels=True, tickangle=45)
     fig.for_each_yaxis(lambda y: y.update(matches=None))
     fig.update_layout(template='plotly_white')
+    return fig
+
+def plot_all_traits(df, genotype, out_html):
+    """
+    Plots all traits in a faceted line chart, one subplot per trait.
 
+    Parameters:
+    - df (pd.DataFrame): Combined DataFrame of all traits.
+    - genotype (str): Genotype label to display in the title.
+    - out_html (str): Saves the plot to a HTML file.
+    """
+    fig = all_traits_figure(df, genotype)
     if out_html:
         fig.write_html(out_html)
         print(f"Saved plot to {out_html}")
@@ -144,13 +227,19 @@ def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--genotype", required=True, help="Genotype name")
     parser.add_argument("--trait", help="Single trait to plot")
-    parser.add_argument("--file1", required=True, help="Excel file for region 1")
-    parser.add_argument("--file2", required=True, help="Excel file for region 2")
+    parser.add_argument("--file1", help="Excel file or plot-level store folder for region 1")
+    parser.add_argument("--file2", help="Excel file or plot-level store folder for region 2")
+    parser.add_argument("--combined", help="Combined batch Excel file with a Region column, or a plot store partitioned by Experiment (replaces --file1/--file2)")
     parser.add_argument("--region1", required=True, help="Label for region 1")
     parser.add_argument("--region2", required=True, help="Label for region 2")
     parser.add_argument('--output', required=True, help='Output HTML file')
     args = parser.parse_args()
 
+    if args.combined:
+        args.file1 = args.file2 = args.combined
+    elif not (args.file1 and args.file2):
+        parser.error("either --combined or both --file1 and --file2 are required")
+
     if args.trait:
         df1 = normalize_condition_labels(
             compute_trait_by_region(args.file1, args.trait, args.genotype, region_label=args.region1)
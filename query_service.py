@@ -0,0 +1,289 @@
+import argparse
+import json
+import os
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import pandas as pd
+from excel_export import read_excel_sheets
+from plasticity import (
+    all_traits_figure,
+    normalize_condition_labels,
+    raw_trait_figure,
+    summarize_by_condition,
+)
+
+class DatasetUnavailable(Exception):
+    """
+    Raised when a changed source file cannot be read (e.g. while it is being rewritten).
+    """
+
+class Dataset:
+    """
+    A cleaned Excel file held in memory with a Genotype -> row positions index.
+    The file is reloaded when its modification time or size changes.
+
+    The frame, its index and the file signature are published together as one
+    snapshot tuple, so a reader never sees the index of one version with the
+    rows of another.
+    """
+
+    def __init__(self, name, path):
+        self.name = name
+        self.path = path
+        self.snapshot = None  # (df, index, signature)
+        self._lock = threading.Lock()
+        self.refresh()
+
+    def refresh(self):
+        """
+        Reloads the file if it changed on disk. If the new version cannot be
+        read, the previous snapshot is kept and DatasetUnavailable is raised.
+
+        Returns:
+        - bool: True if the dataset was (re)loaded.
+        """
+        try:
+            st = os.stat(self.path)
+        except OSError as e:
+            if self.snapshot is None:
+                raise
+            raise DatasetUnavailable(f"Dataset {self.name} is being updated, try again: {e}") from e
+        signature = (st.st_mtime_ns, st.st_size)
+        if self.snapshot is not None and signature == self.snapshot[2]:
+            return False
+        with self._lock:
+            if self.snapshot is not None and signature == self.snapshot[2]:
+                return False
+            try:
+                df = read_excel_sheets(self.path)
+            except Exception as e:
+                if self.snapshot is None:
+                    raise
+                raise DatasetUnavailable(f"Dataset {self.name} is being updated, try again: {e}") from e
+            df = df.drop(columns=['Unnamed: 0'], errors='ignore')
+            df = normalize_condition_labels(df)
+            df['Genotype'] = df['Genotype'].astype(str)
+            self.snapshot = (df, df.groupby('Genotype').indices, signature)
+        print(f"Loaded {self.name} from {self.path} ({len(df)} rows)")
+        return True
+
+    @property
+    def signature(self):
+        return self.snapshot[2]
+
+    def genotype_rows(self, genotype):
+        df, index, _ = self.snapshot
+        positions = index.get(genotype)
+        if positions is None:
+            return df.iloc[0:0]
+        return df.iloc[positions]
+
+    def genotypes(self):
+        return list(self.snapshot[1])
+
+    def traits(self):
+        return [c for c in self.snapshot[0].select_dtypes(include='number').columns]
+
+class FigureCache:
+    """
+    Thread-safe LRU cache of rendered figure JSON.
+    """
+
+    def __init__(self, max_items=256):
+        self.max_items = max_items
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._items:
+                return None
+            self._items.move_to_end(key)
+            return self._items[key]
+
+    def put(self, key, value):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+class QueryService:
+    """
+    Answers per-genotype stats and figure requests from in-memory datasets.
+    """
+
+    def __init__(self, datasets, cache_size=256):
+        self.datasets = OrderedDict((name, Dataset(name, path)) for name, path in datasets)
+        self.cache = FigureCache(cache_size)
+
+    def _refresh(self):
+        # any source file change invalidates every cached figure
+        if any([ds.refresh() for ds in self.datasets.values()]):
+            self.cache.clear()
+
+    def _select(self, names):
+        if not names:
+            return list(self.datasets.values())
+        missing = [n for n in names if n not in self.datasets]
+        if missing:
+            raise KeyError(f"Unknown dataset(s): {', '.join(missing)}")
+        return [self.datasets[n] for n in names]
+
+    def list_datasets(self):
+        self._refresh()
+        return [{'name': ds.name, 'path': ds.path, 'genotypes': len(ds.genotypes()), 'traits': ds.traits()}
+                for ds in self.datasets.values()]
+
+    def genotypes(self, names=None):
+        self._refresh()
+        return sorted({g for ds in self._select(names) for g in ds.genotypes()})
+
+    def stats(self, genotype, trait=None, names=None):
+        """
+        Averages traits by condition for one genotype in each dataset.
+        Datasets with a Region column (combined batch files) are split by region.
+
+        Returns:
+        - pd.DataFrame: One row per region and condition, with a Region column holding
+          the region, or the dataset name when the file has no Region column.
+        """
+        self._refresh()
+        frames = []
+        for ds in self._select(names):
+            rows = ds.genotype_rows(genotype)
+            if rows.empty:
+                continue
+            if trait is not None:
+                if trait not in rows.columns:
+                    raise KeyError(f"Unknown trait '{trait}' in dataset {ds.name}")
+                rows = rows[[c for c in ('Region', 'Genotype', 'Condition') if c in rows.columns] + [trait]]
+            if 'Region' in rows.columns:
+                for region, group in rows.groupby('Region', sort=False):
+                    frames.append(summarize_by_condition(group, genotype, region_label=region))
+            else:
+                frames.append(summarize_by_condition(rows, genotype, region_label=ds.name))
+        if not frames:
+            raise KeyError(f"Genotype '{genotype}' not found")
+        return pd.concat(frames, ignore_index=True)
+
+    def figure_json(self, genotype, trait=None, names=None):
+        """
+        Returns the plotly figure JSON for one genotype, rendered once per
+        source-file version and then served from the LRU cache.
+        """
+        self._refresh()
+        selected = self._select(names)
+        key = (genotype, trait, tuple((ds.name, ds.signature) for ds in selected))
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+
+        df = self.stats(genotype, trait=trait, names=[ds.name for ds in selected])
+        if trait is not None:
+            fig = raw_trait_figure(df, trait, genotype)
+        else:
+            fig = all_traits_figure(df, genotype)
+        payload = fig.to_json()
+        self.cache.put(key, payload)
+        return payload
+
+def make_handler(service):
+    """
+    Builds the HTTP request handler bound to a QueryService.
+
+    Endpoints (GET, JSON responses):
+    - /datasets
+    - /genotypes[?dataset=NAME]
+    - /stats?genotype=G[&trait=T][&dataset=NAME...]
+    - /figure?genotype=G[&trait=T][&dataset=NAME...]
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def _send(self, status, body):
+            data = body.encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            query = parse_qs(url.query)
+            genotype = query.get('genotype', [None])[0]
+            trait = query.get('trait', [None])[0]
+            names = query.get('dataset')
+            try:
+                if url.path == '/datasets':
+                    body = json.dumps(service.list_datasets())
+                elif url.path == '/genotypes':
+                    body = json.dumps(service.genotypes(names))
+                elif url.path in ('/stats', '/figure'):
+                    if genotype is None:
+                        raise ValueError("Missing required parameter: genotype")
+                    if url.path == '/stats':
+                        body = service.stats(genotype, trait=trait, names=names).to_json(orient='records')
+                    else:
+                        body = service.figure_json(genotype, trait=trait, names=names)
+                else:
+                    self._send(404, json.dumps({'error': f"Unknown endpoint: {url.path}"}))
+                    return
+            except DatasetUnavailable as e:
+                self._send(503, json.dumps({'error': str(e)}))
+                return
+            except KeyError as e:
+                self._send(404, json.dumps({'error': e.args[0]}))
+                return
+            except ValueError as e:
+                self._send(400, json.dumps({'error': str(e)}))
+                return
+            self._send(200, body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+def parse_dataset(value):
+    """
+    Parses a NAME=PATH dataset argument; the file name is used when NAME is omitted.
+    """
+    if '=' in value:
+        name, path = value.split('=', 1)
+    else:
+        path = value
+        name = os.path.splitext(os.path.basename(value))[0]
+    return name, path
+
+def main():
+    """
+    CLI for serving per-genotype stats and figures over local HTTP.
+    """
+    p = argparse.ArgumentParser(description="Serve per-genotype trait stats and figures from cleaned files.")
+    p.add_argument('--dataset', action='append', type=parse_dataset, required=True,
+                   help='Cleaned Excel file to serve, as NAME=PATH (repeat for several regions)')
+    p.add_argument('--host', default='127.0.0.1', help='Address to bind')
+    p.add_argument('--port', type=int, default=8050, help='Port to listen on')
+    p.add_argument('--cache-size', type=int, default=256, help='Number of rendered figures kept in memory')
+    args = p.parse_args()
+
+    service = QueryService(args.dataset, cache_size=args.cache_size)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(service))
+    print(f"Serving on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,280 @@
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from scipy import stats
+from comparisons import plot_traits_grid
+from excel_export import read_excel_sheets, write_excel
+from line import normalize_condition_labels
+from trait_store import read_plot_store
+
+LABEL_COLS = ['Experiment', 'Region', 'Condition', 'Genotype', 'plot_number', 'Unnamed: 0']
+
+def replicate_arrays(df_plots, traits=None, cond_a='HI', cond_b='LI'):
+    """
+    Reshapes plot-level rows into NaN-padded genotype x trait x replicate arrays,
+    one per condition.
+
+    Parameters:
+    - df_plots (pd.DataFrame): Plot-level rows with 'Genotype', 'Condition' and trait columns.
+    - traits (list): Traits to include. If None, all numeric traits are used.
+    - cond_a (str): First condition (e.g. 'HI').
+    - cond_b (str): Second condition (e.g. 'LI').
+
+    Returns:
+    - tuple: (genotypes, traits, array for cond_a, array for cond_b).
+    """
+    if traits is None:
+        traits = [c for c in df_plots.select_dtypes(include='number').columns if c not in LABEL_COLS]
+    df = df_plots[df_plots['Condition'].isin([cond_a, cond_b])]
+    genotypes = sorted(df['Genotype'].astype(str).unique())
+    g_pos = {g: i for i, g in enumerate(genotypes)}
+
+    arrays = []
+    for cond in (cond_a, cond_b):
+        sub = df[df['Condition'] == cond]
+        rows = sub['Genotype'].astype(str).map(g_pos).to_numpy()
+        reps = sub.groupby('Genotype').cumcount().to_numpy()
+        n_reps = reps.max() + 1 if len(reps) else 1
+        arr = np.full((len(genotypes), len(traits), n_reps), np.nan)
+        arr[rows, :, reps] = sub[traits].to_numpy(dtype=np.float64)
+        arrays.append(arr)
+    return genotypes, list(traits), arrays[0], arrays[1]
+
+def welch_ttest(a, b):
+    """
+    Welch's t-test along the last axis for every genotype x trait at once.
+
+    Parameters:
+    - a (np.ndarray): ... x replicates, NaN-padded.
+    - b (np.ndarray): ... x replicates, NaN-padded.
+
+    Returns:
+    - dict: 'n_a', 'n_b', 'mean_a', 'mean_b', 't', 'df', 'p' arrays (NaN where a group has < 2 values).
+    """
+    n_a = np.sum(~np.isnan(a), axis=-1)
+    n_b = np.sum(~np.isnan(b), axis=-1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean_a = np.nansum(a, axis=-1) / n_a
+        mean_b = np.nansum(b, axis=-1) / n_b
+        var_a = np.nansum((a - mean_a[..., None]) ** 2, axis=-1) / (n_a - 1)
+        var_b = np.nansum((b - mean_b[..., None]) ** 2, axis=-1) / (n_b - 1)
+        se_a = var_a / n_a
+        se_b = var_b / n_b
+        t = (mean_a - mean_b) / np.sqrt(se_a + se_b)
+        dof = (se_a + se_b) ** 2 / (se_a ** 2 / (n_a - 1) + se_b ** 2 / (n_b - 1))
+    p = 2 * stats.t.sf(np.abs(t), dof)
+    small = (n_a < 2) | (n_b < 2)
+    t[small] = np.nan
+    dof[small] = np.nan
+    p[small] = np.nan
+    return {'n_a': n_a, 'n_b': n_b, 'mean_a': mean_a, 'mean_b': mean_b, 't': t, 'df': dof, 'p': p}
+
+# arrays shared with permutation workers, set once per process by _init_worker
+_PERM = {}
+
+def _init_worker(pooled, n_a, observed, batch_size):
+    _PERM['valid'] = ~np.isnan(pooled)
+    _PERM['filled'] = np.nan_to_num(pooled)
+    _PERM['n_a'] = n_a
+    _PERM['observed'] = np.abs(observed) - 1e-12
+    _PERM['batch_size'] = batch_size
+
+def _permutation_counts(args):
+    """
+    Runs n_perm label permutations in batches and counts, per genotype x trait,
+    how often the permuted |mean difference| reaches the observed one.
+    """
+    n_perm, seed = args
+    valid = _PERM['valid']
+    filled = _PERM['filled']
+    n_a = _PERM['n_a']
+    n_total = valid.sum(axis=-1)
+    n_b = n_total - n_a
+    total = filled.sum(axis=-1)
+    first = np.arange(valid.shape[-1]) < n_a[..., None]
+
+    rng = np.random.default_rng(seed)
+    counts = np.zeros(n_a.shape, dtype=np.int64)
+    done = 0
+    while done < n_perm:
+        batch = min(_PERM['batch_size'], n_perm - done)
+        # random order of the valid replicates; missing ones sort last
+        keys = rng.random((batch,) + valid.shape)
+        keys[:, ~valid] = np.inf
+        order = np.argsort(keys, axis=-1)
+        shuffled = np.take_along_axis(np.broadcast_to(filled, keys.shape), order, axis=-1)
+        sum_a = np.where(first, shuffled, 0.0).sum(axis=-1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            diff = sum_a / n_a - (total - sum_a) / n_b
+        counts += (np.abs(diff) >= _PERM['observed']).sum(axis=0)
+        done += batch
+    return counts
+
+def permutation_test(a, b, n_perm=9999, seed=0, workers=None, batch_size=None, memory_mb=256):
+    """
+    Two-sided permutation test on the difference of means for every
+    genotype x trait at once. Permutation batches are spread across a
+    process pool.
+
+    Parameters:
+    - a (np.ndarray): genotype x trait x replicates for the first condition, NaN-padded.
+    - b (np.ndarray): genotype x trait x replicates for the second condition, NaN-padded.
+    - n_perm (int): Number of permutations.
+    - seed (int): Random seed.
+    - workers (int): Number of worker processes (defaults to the CPU count).
+    - batch_size (int): Permutations per vectorized batch; derived from memory_mb if None.
+    - memory_mb (float): Approximate memory per worker for one batch.
+
+    Returns:
+    - np.ndarray: Permutation p-values, (count + 1) / (n_perm + 1).
+    """
+    pooled = np.concatenate([a, b], axis=-1)
+    n_a = np.sum(~np.isnan(a), axis=-1)
+    n_b = np.sum(~np.isnan(b), axis=-1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        observed = np.nansum(a, axis=-1) / n_a - np.nansum(b, axis=-1) / n_b
+
+    if batch_size is None:
+        # keys, order, shuffled and masked copies: roughly 4 arrays of 8 bytes per cell
+        batch_size = max(1, int(memory_mb * 2 ** 20 // (pooled.size * 8 * 4)))
+
+    # a few tasks per worker so the pool stays busy when batches finish unevenly
+    n_tasks = max(1, min(n_perm, (workers or os.cpu_count() or 1) * 4))
+    sizes = [n_perm // n_tasks + (i < n_perm % n_tasks) for i in range(n_tasks)]
+    seeds = np.random.SeedSequence(seed).spawn(n_tasks)
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(pooled, n_a, observed, batch_size)) as pool:
+        counts = sum(pool.map(_permutation_counts, zip(sizes, seeds)))
+
+    p = (counts + 1) / (n_perm + 1)
+    p = p.astype(np.float64)
+    p[np.isnan(observed)] = np.nan
+    return p
+
+def benjamini_hochberg(p):
+    """
+    Benjamini–Hochberg FDR adjustment over all non-NaN p-values.
+
+    Parameters:
+    - p (np.ndarray): p-values of any shape.
+
+    Returns:
+    - np.ndarray: q-values with the same shape (NaN stays NaN).
+    """
+    p = np.asarray(p, dtype=np.float64)
+    q = np.full(p.shape, np.nan)
+    flat = p.ravel()
+    ok = np.flatnonzero(~np.isnan(flat))
+    m = len(ok)
+    if m == 0:
+        return q
+    order = ok[np.argsort(flat[ok])]
+    ranked = flat[order] * m / np.arange(1, m + 1)
+    ranked = np.minimum.accumulate(ranked[::-1])[::-1]
+    q.ravel()[order] = np.minimum(ranked, 1.0)
+    return q
+
+def significance_table(df_plots, traits=None, n_perm=9999, seed=0, workers=None, alpha=0.05,
+                       cond_a='HI', cond_b='LI'):
+    """
+    Runs Welch and permutation tests of cond_a vs cond_b for every genotype x trait
+    and adjusts both with Benjamini–Hochberg.
+
+    Parameters:
+    - df_plots (pd.DataFrame): Plot-level rows with 'Genotype', 'Condition' and trait columns.
+    - traits (list): Traits to test. If None, all numeric traits are used.
+    - n_perm (int): Number of permutations (0 skips the permutation test).
+    - seed (int): Random seed.
+    - workers (int): Number of worker processes.
+    - alpha (float): FDR level used for the 'Significant' column.
+    - cond_a (str): First condition.
+    - cond_b (str): Second condition.
+
+    Returns:
+    - pd.DataFrame: One row per genotype x trait with means, test statistics, p- and q-values.
+    """
+    genotypes, traits, a, b = replicate_arrays(df_plots, traits, cond_a=cond_a, cond_b=cond_b)
+    welch = welch_ttest(a, b)
+    q_welch = benjamini_hochberg(welch['p'])
+
+    results = {
+        'Genotype': np.repeat(genotypes, len(traits)),
+        'Trait': np.tile(traits, len(genotypes)),
+        f'n_{cond_a}': welch['n_a'].ravel(),
+        f'n_{cond_b}': welch['n_b'].ravel(),
+        f'Mean_{cond_a}': welch['mean_a'].ravel(),
+        f'Mean_{cond_b}': welch['mean_b'].ravel(),
+        'Difference': (welch['mean_a'] - welch['mean_b']).ravel(),
+        't': welch['t'].ravel(),
+        'df': welch['df'].ravel(),
+        'p_welch': welch['p'].ravel(),
+        'q_welch': q_welch.ravel(),
+    }
+    q_col = 'q_welch'
+    if n_perm > 0:
+        p_perm = permutation_test(a, b, n_perm=n_perm, seed=seed, workers=workers)
+        results['p_perm'] = p_perm.ravel()
+        results['q_perm'] = benjamini_hochberg(p_perm).ravel()
+        q_col = 'q_perm'
+
+    df = pd.DataFrame(results)
+    df['Significant'] = df[q_col] < alpha
+    return df
+
+def main():
+    """
+    CLI for HI vs LI significance testing on plot-level replicates.
+    """
+    p = argparse.ArgumentParser(description="Welch and permutation tests of HI vs LI per genotype and trait, with BH FDR.")
+    p.add_argument('--store', help='Plot-level store folder (from combine_and_clean_data.py --plot-store)')
+    p.add_argument('--input', help='Plot-level Excel file (alternative to --store)')
+    p.add_argument('--output', default="/srv/data/significance.xlsx", help='Path to save the results table (Excel)')
+    p.add_argument('--grid-output', help='Optional path to save the annotated trait grid (HTML)')
+    p.add_argument('--experiment', help='Experiment to test; required when the data holds several experiments')
+    p.add_argument('--traits', nargs='+', help='Traits to test (default: all numeric traits)')
+    p.add_argument('--permutations', type=int, default=9999, help='Number of permutations (0 to skip)')
+    p.add_argument('--alpha', type=float, default=0.05, help='FDR level for significance')
+    p.add_argument('--seed', type=int, default=0, help='Random seed for the permutations')
+    p.add_argument('--workers', type=int, help='Number of worker processes (default: CPU count)')
+    p.add_argument('--cols', type=int, default=2, help='Number of columns in the grid layout')
+    args = p.parse_args()
+
+    experiments = [args.experiment] if args.experiment else None
+    if args.store:
+        df = read_plot_store(args.store, experiments=experiments, traits=args.traits)
+    elif args.input:
+        df = read_excel_sheets(args.input)
+        if experiments and 'Experiment' in df.columns:
+            df = df[df['Experiment'].isin(experiments)]
+    else:
+        p.error("either --store or --input is required")
+
+    # replicates from different sites must not be pooled into one test
+    if 'Experiment' in df.columns:
+        found = sorted(df['Experiment'].astype(str).unique())
+        if args.experiment and not found:
+            p.error(f"experiment '{args.experiment}' not found")
+        if len(found) > 1:
+            p.error(f"the data holds several experiments ({', '.join(found)}); choose one with --experiment")
+    df = normalize_condition_labels(df)
+
+    results = significance_table(
+        df,
+        traits=args.traits,
+        n_perm=args.permutations,
+        seed=args.seed,
+        workers=args.workers,
+        alpha=args.alpha
+    )
+    write_excel(results, args.output)
+    print(f"Saved {int(results['Significant'].sum())} significant of {len(results)} tests to {args.output}")
+
+    if args.grid_output:
+        plot_traits_grid(df, traits=args.traits, cols=args.cols,
+                         out_html=args.grid_output, significance=results)
+
+if __name__ == '__main__':
+    main()
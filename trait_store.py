@@ -0,0 +1,131 @@
+import argparse
+import os
+import pyarrow as pa
+import pyarrow.dataset as ds
+from excel_export import write_excel
+
+LABEL_COLS = ['Experiment', 'Condition', 'Genotype', 'plot_number']
+
+def write_plot_store(df_plots, root, row_group_rows=2048):
+    """
+    Writes plot-level trait rows to a Parquet store partitioned by Condition,
+    and by Experiment when that column is present (e.g. root/Experiment=AZ/Condition=HI/).
+    Rows are sorted by Genotype inside each partition so row-group statistics
+    let readers skip everything but the requested genotypes.
+
+    Parameters:
+    - df_plots (pd.DataFrame): Plot-level rows with 'Genotype', 'Condition' and trait columns.
+    - root (str): Folder of the store. Partitions being written are replaced, others are kept.
+    - row_group_rows (int): Maximum rows per Parquet row group.
+    """
+    partition_cols = [c for c in ('Experiment', 'Condition') if c in df_plots.columns]
+    if 'Condition' not in partition_cols:
+        raise ValueError("Plot-level data needs a 'Condition' column to be stored.")
+
+    df = df_plots.dropna(subset=['Genotype', 'Condition'])
+    df = df.astype({c: str for c in partition_cols + ['Genotype']})
+    df = df.sort_values(partition_cols + ['Genotype'], ignore_index=True)
+
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    ds.write_dataset(
+        table,
+        root,
+        format='parquet',
+        partitioning=partition_cols,
+        partitioning_flavor='hive',
+        max_rows_per_group=row_group_rows,
+        min_rows_per_group=min(row_group_rows, len(df)),
+        existing_data_behavior='delete_matching'
+    )
+
+def _partition_fields(root):
+    """
+    Returns the hive partition keys used under root, read from its folder names.
+    """
+    fields = []
+    path = root
+    while True:
+        subdirs = sorted(d for d in os.listdir(path)
+                         if '=' in d and os.path.isdir(os.path.join(path, d)))
+        if not subdirs:
+            return fields
+        fields.append(subdirs[0].split('=', 1)[0])
+        path = os.path.join(path, subdirs[0])
+
+def open_plot_store(root):
+    """
+    Opens a plot-level store as a pyarrow dataset with string partition keys.
+
+    Parameters:
+    - root (str): Folder of the store.
+
+    Returns:
+    - pyarrow.dataset.Dataset: Lazily scanned dataset.
+    """
+    if not os.path.isdir(root):
+        raise ValueError(f"Plot store not found: {root}")
+    schema = pa.schema([(f, pa.string()) for f in _partition_fields(root)])
+    partitioning = ds.partitioning(schema, flavor='hive')
+    return ds.dataset(root, format='parquet', partitioning=partitioning)
+
+def read_plot_store(root, genotypes=None, conditions=None, experiments=None, traits=None):
+    """
+    Reads plot-level rows from a store, pushing filters and column selection
+    down to the Parquet scan. Partition filters skip whole folders and the
+    genotype filter skips row groups, so only the requested data is read.
+
+    Parameters:
+    - root (str): Folder of the store.
+    - genotypes (list): Genotypes to keep. If None, all genotypes are read.
+    - conditions (list): Conditions to keep. If None, all conditions are read.
+    - experiments (list): Experiments to keep, ignored when the store has no Experiment partition.
+    - traits (list): Trait columns to read. If None, all traits are read.
+
+    Returns:
+    - pd.DataFrame: Plot-level rows with label columns and the requested traits.
+    """
+    dataset = open_plot_store(root)
+    names = dataset.schema.names
+
+    filters = []
+    for col, values in (('Genotype', genotypes), ('Condition', conditions), ('Experiment', experiments)):
+        if values is not None and col in names:
+            filters.append(ds.field(col).isin([str(v) for v in values]))
+    expr = None
+    for f in filters:
+        expr = f if expr is None else expr & f
+
+    columns = None
+    if traits is not None:
+        missing = [t for t in traits if t not in names]
+        if missing:
+            raise ValueError(f"Traits not found in plot store: {', '.join(missing)}")
+        columns = [c for c in LABEL_COLS if c in names] + list(traits)
+
+    return dataset.to_table(columns=columns, filter=expr).to_pandas()
+
+def main():
+    """
+    CLI for querying a plot-level store and saving the selection as Excel.
+    """
+    p = argparse.ArgumentParser(description="Query a plot-level trait store.")
+    p.add_argument('--store', default="/srv/data/plots", help='Folder of the plot-level store')
+    p.add_argument('--output', default="/srv/data/plots.xlsx", help='Path to save the selected rows (Excel)')
+    p.add_argument('--genotypes', nargs='+', help='Genotypes to keep (default: all)')
+    p.add_argument('--conditions', nargs='+', help='Conditions to keep (default: all)')
+    p.add_argument('--experiments', nargs='+', help='Experiments to keep (default: all)')
+    p.add_argument('--traits', nargs='+', help='Trait columns to read (default: all)')
+    args = p.parse_args()
+
+    df = read_plot_store(
+        args.store,
+        genotypes=args.genotypes,
+        conditions=args.conditions,
+        experiments=args.experiments,
+        traits=args.traits
+    )
+    write_excel(df, args.output)
+    print(f"Saved {len(df)} plot rows to {args.output}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,214 @@
+import argparse
+import json
+import os
+import numpy as np
+import pandas as pd
+from excel_export import read_excel_sheets
+
+DIM_COLUMNS = {
+    'region': 'Region',
+    'genotype': 'Genotype',
+    'condition': 'Condition',
+}
+NON_TRAITS = ['Region', 'Experiment', 'Genotype', 'Condition', 'plot_number', 'Replicate', 'Unnamed: 0']
+
+class TraitTensor:
+    """
+    Dense labelled array of trait values with axes
+    [region,] genotype, condition, [replicate,] trait.
+
+    Selecting a single label or a contiguous run of labels returns a view,
+    so slicing one genotype or one trait does not copy or scan the data.
+    Saved tensors are reopened as read-only memory maps.
+    """
+
+    def __init__(self, values, dims, coords):
+        if values.ndim != len(dims):
+            raise ValueError(f"values has {values.ndim} axes but {len(dims)} dims were given")
+        self.values = values
+        self.dims = tuple(dims)
+        self.coords = {d: list(coords[d]) for d in self.dims}
+        self._pos = {d: {label: i for i, label in enumerate(self.coords[d])} for d in self.dims}
+
+    def __repr__(self):
+        shape = ', '.join(f"{d}={len(self.coords[d])}" for d in self.dims)
+        return f"TraitTensor({shape})"
+
+    @property
+    def traits(self):
+        return self.coords['trait']
+
+    @classmethod
+    def from_frame(cls, df, traits=None):
+        """
+        Builds a tensor from a cleaned or plot-level DataFrame.
+        A 'Region' (or 'Experiment') column adds a region axis; repeated
+        Genotype x Condition rows (plot-level data) add a replicate axis.
+
+        Parameters:
+        - df (pd.DataFrame): Rows with 'Genotype', 'Condition' and trait columns.
+        - traits (list): Traits to include. If None, all numeric traits are used.
+
+        Returns:
+        - TraitTensor: The labelled array (missing combinations are NaN).
+        """
+        df = df.rename(columns={'Experiment': 'Region'})
+        if traits is None:
+            traits = [c for c in df.select_dtypes(include='number').columns if c not in NON_TRAITS]
+
+        dims = [d for d in ('region', 'genotype', 'condition') if DIM_COLUMNS[d] in df.columns]
+        group_cols = [DIM_COLUMNS[d] for d in dims]
+        codes, coords = [], {}
+        for dim, col in zip(dims, group_cols):
+            c, labels = pd.factorize(df[col].astype(str), sort=True)
+            codes.append(c)
+            coords[dim] = list(labels)
+
+        replicate = df.groupby(group_cols, sort=False).cumcount().to_numpy()
+        if replicate.max(initial=0) > 0:
+            dims.append('replicate')
+            codes.append(replicate)
+            coords['replicate'] = list(range(replicate.max() + 1))
+
+        dims.append('trait')
+        coords['trait'] = list(traits)
+
+        shape = [len(coords[d]) for d in dims]
+        values = np.full(shape, np.nan)
+        values[tuple(codes)] = df[traits].to_numpy(dtype=np.float64)
+        return cls(values, dims, coords)
+
+    def save(self, path):
+        """
+        Saves the tensor as <path>/values.npy plus a <path>/labels.json index.
+        """
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, 'values.npy'), np.ascontiguousarray(self.values))
+        with open(os.path.join(path, 'labels.json'), 'w') as fh:
+            json.dump({'dims': list(self.dims), 'coords': self.coords}, fh)
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        """
+        Opens a saved tensor; values are memory-mapped unless mmap_mode is None.
+        """
+        with open(os.path.join(path, 'labels.json')) as fh:
+            labels = json.load(fh)
+        values = np.load(os.path.join(path, 'values.npy'), mmap_mode=mmap_mode)
+        return cls(values, labels['dims'], labels['coords'])
+
+    def _indexer(self, dim, labels):
+        pos = self._pos[dim]
+        if isinstance(labels, (list, tuple, np.ndarray, pd.Index)):
+            missing = [l for l in labels if l not in pos]
+            if missing:
+                raise KeyError(f"Unknown {dim} label(s): {', '.join(map(str, missing))}")
+            idx = [pos[l] for l in labels]
+            # contiguous ascending runs become slices so the result stays a view
+            if idx and idx == list(range(idx[0], idx[0] + len(idx))):
+                return slice(idx[0], idx[0] + len(idx))
+            return np.array(idx, dtype=np.intp)
+        if labels not in pos:
+            raise KeyError(f"Unknown {dim} label: {labels}")
+        return pos[labels]
+
+    def sel(self, **labels):
+        """
+        Selects by label, e.g. tensor.sel(genotype='SC56', trait=['root system length']).
+        A single label drops its axis; a list keeps it.
+
+        Returns:
+        - TraitTensor: Selection (a view for single labels and contiguous lists).
+        """
+        unknown = set(labels) - set(self.dims)
+        if unknown:
+            raise ValueError(f"Unknown dimension(s): {', '.join(sorted(unknown))}")
+
+        values = self.values
+        dims, coords = [], {}
+        # apply one axis at a time so fancy indexers never combine
+        for dim in self.dims:
+            axis = len(dims)
+            if dim not in labels:
+                dims.append(dim)
+                coords[dim] = self.coords[dim]
+                continue
+            idx = self._indexer(dim, labels[dim])
+            index = (slice(None),) * axis + (idx,)
+            values = values[index]
+            if isinstance(idx, (slice, np.ndarray)):
+                dims.append(dim)
+                coords[dim] = list(np.array(self.coords[dim], dtype=object)[idx])
+        return TraitTensor(values, dims, coords)
+
+    def trait_frame(self):
+        """
+        Flattens every axis except trait into rows, without label columns.
+        """
+        if self.dims[-1] != 'trait':
+            raise ValueError("trait_frame needs the trait axis")
+        n_traits = self.values.shape[-1]
+        return pd.DataFrame(np.asarray(self.values).reshape(-1, n_traits), columns=self.traits)
+
+    def to_frame(self):
+        """
+        Converts back to the wide table used by the plotting scripts: one row per
+        label combination with Region/Genotype/Condition columns and one column
+        per trait. Rows that are missing for every trait are dropped.
+        """
+        df = self.trait_frame() if 'trait' in self.dims else pd.DataFrame(
+            {'Value': np.asarray(self.values).ravel()})
+        label_dims = [d for d in self.dims if d in DIM_COLUMNS]
+        other_dims = [d for d in self.dims if d != 'trait']
+        if other_dims:
+            index = pd.MultiIndex.from_product([self.coords[d] for d in other_dims], names=other_dims)
+            labels = index.to_frame(index=False)[label_dims]
+            labels.columns = [DIM_COLUMNS[d] for d in label_dims]
+            df = pd.concat([labels, df], axis=1)
+        value_cols = [c for c in df.columns if c not in NON_TRAITS]
+        return df.dropna(subset=value_cols, how='all').reset_index(drop=True)
+
+def as_frame(data):
+    """
+    Returns data unchanged if it is a DataFrame, or its wide table if it is a TraitTensor.
+    """
+    if isinstance(data, TraitTensor):
+        return data.to_frame()
+    return data
+
+def load_table(path, sheet_name=0):
+    """
+    Opens a saved tensor folder as a TraitTensor, or reads an Excel file as a DataFrame.
+    """
+    if os.path.isdir(path):
+        return TraitTensor.load(path)
+    return read_excel_sheets(path, sheet_name=sheet_name)
+
+def main():
+    """
+    CLI for building a TraitTensor from a cleaned Excel file or a plot-level store.
+    """
+    p = argparse.ArgumentParser(description="Build a Genotype x Condition x Trait tensor (.npy + label index).")
+    p.add_argument('--input', help='Cleaned or plot-level Excel file')
+    p.add_argument('--store', help='Plot-level store folder (alternative to --input)')
+    p.add_argument('--output', default="/srv/data/tensor", help='Folder to save values.npy and labels.json')
+    p.add_argument('--traits', nargs='+', help='Traits to include (default: all numeric traits)')
+    args = p.parse_args()
+
+    from line import normalize_condition_labels
+
+    if args.store:
+        from trait_store import read_plot_store
+        df = read_plot_store(args.store, traits=args.traits)
+    elif args.input:
+        df = read_excel_sheets(args.input)
+    else:
+        p.error("either --input or --store is required")
+    df = normalize_condition_labels(df)
+
+    tensor = TraitTensor.from_frame(df, traits=args.traits)
+    tensor.save(args.output)
+    print(f"Saved {tensor} to {args.output}")
+
+if __name__ == '__main__':
+    main()
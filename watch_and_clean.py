@@ -0,0 +1,207 @@
+import argparse
+import os
+import time
+import pandas as pd
+from combine_and_clean_data import (
+    list_raw_files,
+    load_metadata,
+    plot_number_from_filename,
+    read_trait_file,
+    replace_outliers_iqr,
+    scale_factor,
+)
+from excel_export import write_excel
+
+def _stat_key(path):
+    st = os.stat(path)
+    return (st.st_mtime_ns, st.st_size)
+
+def _atomic_write(path, write):
+    """
+    Writes through a temporary file in the same folder and renames it over
+    path, so readers never see a half-written file.
+    """
+    folder, name = os.path.split(os.path.abspath(path))
+    base, ext = os.path.splitext(name)
+    tmp_path = os.path.join(folder, f".{base}.tmp{ext}")
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+def new_state(metadata_path):
+    """
+    Returns an empty aggregation state for the given metadata file.
+    """
+    metadata_long = load_metadata(metadata_path)
+    return {
+        'metadata_key': _stat_key(metadata_path),
+        'metadata': metadata_long,
+        'files': {},          # path -> {'key', 'plot', 'sums', 'counts'}
+        'plot_files': {},     # plot_number -> set of paths
+        'plot_means': pd.DataFrame(),
+        'group_means': pd.DataFrame(),
+    }
+
+def load_state(state_path, metadata_path):
+    """
+    Loads the aggregation state, starting over when it is missing or the
+    metadata file has changed since it was saved.
+    """
+    if os.path.exists(state_path):
+        state = pd.read_pickle(state_path)
+        if state['metadata_key'] == _stat_key(metadata_path):
+            return state
+        print("Metadata changed, rebuilding from scratch")
+    return new_state(metadata_path)
+
+def save_state(state, state_path):
+    _atomic_write(state_path, lambda tmp: pd.to_pickle(state, tmp))
+
+def _file_contribution(path):
+    """
+    Reads one raw file and returns its plot number with per-trait sums and counts.
+    """
+    df = read_trait_file(path)
+    df = df.drop(columns=['Unnamed: 0'], errors='ignore')
+    numeric = df.select_dtypes(include='number')
+    return plot_number_from_filename(path), numeric.sum(), numeric.count()
+
+def update_state(state, input_dir):
+    """
+    Folds new or changed raw files into the state and retracts deleted ones.
+    Only the plots touched by those files, and the Genotype x Condition groups
+    they belong to, are recomputed.
+
+    Parameters:
+    - state (dict): Aggregation state from load_state.
+    - input_dir (str): Folder containing raw trait files.
+
+    Returns:
+    - int: Number of raw files added, changed or removed (unreadable files are not counted).
+    """
+    files = state['files']
+    current = {os.path.abspath(path): _stat_key(path)
+               for path in list_raw_files(os.path.join(input_dir, '*'))}
+
+    removed = [p for p in files if p not in current]
+    changed = [p for p, key in current.items() if p not in files or files[p]['key'] != key]
+    if not removed and not changed:
+        return 0
+
+    replaced = [p for p in changed if p in files]
+    affected_plots = set()
+    for path in removed + replaced:
+        old = files.pop(path)
+        state['plot_files'][old['plot']].discard(path)
+        affected_plots.add(old['plot'])
+
+    failed = 0
+    for path in changed:
+        try:
+            plot, sums, counts = _file_contribution(path)
+        except Exception as e:
+            # typically a file that is still being copied; it is not recorded,
+            # so the next poll picks it up again
+            print(f"Skipping unreadable raw file {path}: {e}")
+            # a failed new file changes nothing; a failed replacement still retracted the old version
+            failed += path not in replaced
+            continue
+        files[path] = {'key': current[path], 'plot': plot, 'sums': sums, 'counts': counts}
+        state['plot_files'].setdefault(plot, set()).add(path)
+        affected_plots.add(plot)
+
+    # per-plot means over all rows of the plot's files
+    plot_means = state['plot_means']
+    new_rows = {}
+    for plot in affected_plots:
+        paths = state['plot_files'].get(plot)
+        if not paths:
+            state['plot_files'].pop(plot, None)
+            continue
+        sums = pd.concat([files[p]['sums'] for p in paths], axis=1).sum(axis=1)
+        counts = pd.concat([files[p]['counts'] for p in paths], axis=1).sum(axis=1)
+        new_rows[plot] = sums / counts.where(counts > 0)
+    plot_means = plot_means.drop(index=list(affected_plots), errors='ignore')
+    if new_rows:
+        plot_means = pd.concat([plot_means, pd.DataFrame.from_dict(new_rows, orient='index')])
+    state['plot_means'] = plot_means
+
+    # Genotype x Condition means for the groups those plots belong to
+    metadata = state['metadata']
+    affected_groups = metadata[metadata['plot_number'].isin(affected_plots)]
+    affected_groups = affected_groups[['Genotype', 'Condition']].drop_duplicates()
+    group_index = pd.MultiIndex.from_frame(affected_groups)
+    members = metadata.merge(affected_groups, on=['Genotype', 'Condition'])
+    members = members[members['plot_number'].isin(plot_means.index)]
+
+    group_means = state['group_means'].drop(index=group_index, errors='ignore')
+    if not members.empty:
+        rows = plot_means.loc[members['plot_number']].set_axis(
+            pd.MultiIndex.from_frame(members[['Genotype', 'Condition']]))
+        group_means = pd.concat([group_means, rows.groupby(level=[0, 1]).mean()])
+    state['group_means'] = group_means.sort_index()
+
+    return len(removed) + len(changed) - failed
+
+def publish(state, output_name):
+    """
+    Scales and outlier-handles the Genotype x Condition means and atomically
+    replaces the cleaned output file.
+    """
+    df = state['group_means'].rename_axis(['Genotype', 'Condition']).reset_index()
+    df_scaled = scale_factor(df)
+    df_cleaned = replace_outliers_iqr(df_scaled, k=1.5, winsorise=True)
+    _atomic_write(output_name, lambda tmp: write_excel(df_cleaned, tmp))
+    print(f"Saved cleaned dataset to: {output_name}")
+
+def watch(input_dir, metadata_path, output_name, state_path=None, interval=30.0, once=False):
+    """
+    Keeps the cleaned output in sync with the raw folder. Each poll folds in
+    new or changed files, retracts deleted ones and republishes the output.
+
+    Parameters:
+    - input_dir (str): Folder containing raw trait files.
+    - metadata_path (str): Path to the metadata Excel file.
+    - output_name (str): Path of the cleaned output Excel file.
+    - state_path (str): Path of the aggregation state file (default: next to the output).
+    - interval (float): Seconds between polls.
+    - once (bool): Apply pending changes once and exit.
+    """
+    state_path = state_path or os.path.splitext(output_name)[0] + '.state.pkl'
+    state = load_state(state_path, metadata_path)
+
+    while True:
+        if _stat_key(metadata_path) != state['metadata_key']:
+            print("Metadata changed, rebuilding from scratch")
+            state = new_state(metadata_path)
+        n_changes = update_state(state, input_dir)
+        if state['group_means'].empty:
+            # nothing readable maps to a metadata plot yet (e.g. an empty raw folder)
+            if n_changes:
+                print(f"Folded in {n_changes} raw file change(s); no plots match the metadata yet, nothing to publish")
+                save_state(state, state_path)
+        elif n_changes or not os.path.exists(output_name):
+            print(f"Folded in {n_changes} raw file change(s)")
+            publish(state, output_name)
+            save_state(state, state_path)
+        if once:
+            return
+        time.sleep(interval)
+
+def main():
+    """
+    CLI for incrementally cleaning raw trait files as they arrive.
+    """
+    p = argparse.ArgumentParser(description="Watch the raw folder and keep the cleaned file up to date.")
+    p.add_argument('--input-dir', default='data/raw', help="Folder containing raw trait files")
+    p.add_argument('--metadata', default='data/meta.xlsx', help="Metadata file (Excel)")
+    p.add_argument('--output', default="/srv/data/cleaned.xlsx", help="Path of the cleaned file to keep up to date")
+    p.add_argument('--state', help="Aggregation state file (default: <output>.state.pkl)")
+    p.add_argument('--interval', type=float, default=30.0, help="Seconds between polls of the raw folder")
+    p.add_argument('--once', action='store_true', help="Apply pending changes once and exit")
+    args = p.parse_args()
+
+    watch(args.input_dir, args.metadata, args.output,
+          state_path=args.state, interval=args.interval, once=args.once)
+
+if __name__ == '__main__':
+    main()